@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Aggregation of network results per region, road class, route or any other
+    segment attribute.
+    The integer group index of every segment is built once per grouping
+    (np.unique), after which the group sums are np.bincount reductions. The
+    sums are kept up to date incrementally: when the results of a subset of
+    segments change, only the difference of those segments is added to the
+    groups, so dashboards refresh without re-aggregating the whole network.
+
+Usage:
+    aggregation = EncounterAggregation(
+        {'municipality': municipalityIds, 'roadClass': roadClasses},
+        segments['length_km'], results)
+    aggregation.table('municipality')
+    aggregation.update(changedSegments, changedResults)
+"""
+
+import numpy as np
+
+
+class EncounterAggregation:
+    """
+    Group sums and densities of per-segment results.
+
+    Parameters
+    ----------
+    groupings : dict
+        Grouping name -> group label of every segment (e.g. region ids)
+    lengthKm : array_like
+        Length of every segment [km]
+    results : dict of arrays
+        Result name -> value per segment, e.g. computeEncountersNetwork results
+    """
+
+    def __init__(self, groupings, lengthKm, results):
+        self.lengthKm = np.array(lengthKm, dtype=float)
+        nSegments = self.lengthKm.size
+        self.results = {name: np.array(value, dtype=float) for name, value in results.items()}
+        for name, value in self.results.items():
+            if value.shape != (nSegments,):
+                raise ValueError(f'Result {name} must have one value per segment ({nSegments})')
+
+        #Group index of every segment, built once per grouping
+        self.labels, self.index, self.lengthSums, self.counts, self.sums = {}, {}, {}, {}, {}
+        for grouping, groupLabels in groupings.items():
+            groupLabels = np.asarray(groupLabels)
+            if groupLabels.shape != (nSegments,):
+                raise ValueError(f'Grouping {grouping} must have one label per segment ({nSegments})')
+            self.labels[grouping], index = np.unique(groupLabels, return_inverse=True)
+            self.index[grouping] = index.ravel()
+            self._sumGroups(grouping)
+
+    def _sumGroups(self, grouping):
+        index = self.index[grouping]
+        nGroups = self.labels[grouping].size
+        self.counts[grouping] = np.bincount(index, minlength=nGroups)
+        self.lengthSums[grouping] = np.bincount(index, weights=self.lengthKm, minlength=nGroups)
+        self.sums[grouping] = {name: np.bincount(index, weights=value, minlength=nGroups)
+                               for name, value in self.results.items()}
+
+    def update(self, segments, results, lengthKm=None):
+        """
+        Replace the results of a subset of segments and update the group sums.
+
+        Parameters
+        ----------
+        segments : array_like
+            Indices (or boolean mask) of the changed segments
+        results : dict of arrays
+            Result name -> new value of every changed segment
+        lengthKm : array_like or None
+            New lengths of the changed segments, if they changed
+        """
+        segments = np.arange(self.lengthKm.size)[segments]
+        if np.unique(segments).size != segments.size:
+            raise ValueError('Every changed segment can only be given once')
+        deltas = {}
+        for name, value in results.items():
+            if name not in self.results:
+                raise KeyError(f'Unknown result {name}')
+            value = np.broadcast_to(np.asarray(value, dtype=float), segments.shape)
+            deltas[name] = value - self.results[name][segments]
+            self.results[name][segments] = value
+        if lengthKm is not None:
+            lengthKm = np.broadcast_to(np.asarray(lengthKm, dtype=float), segments.shape)
+            lengthDelta = lengthKm - self.lengthKm[segments]
+            self.lengthKm[segments] = lengthKm
+
+        #Only the changed segments are reduced
+        for grouping, index in self.index.items():
+            changedIndex = index[segments]
+            nGroups = self.labels[grouping].size
+            for name, delta in deltas.items():
+                self.sums[grouping][name] += np.bincount(changedIndex, weights=delta, minlength=nGroups)
+            if lengthKm is not None:
+                self.lengthSums[grouping] += np.bincount(changedIndex, weights=lengthDelta, minlength=nGroups)
+
+    def refresh(self):
+        """
+        Recompute all group sums from the segment results, which removes the
+        rounding errors that many incremental updates accumulate.
+        """
+        for grouping in self.index:
+            self._sumGroups(grouping)
+
+    def table(self, grouping):
+        """
+        Aggregated results of one grouping.
+
+        Returns
+        -------
+        table : dict of arrays
+            'group' labels, number of 'segments', 'length_km', the sum of every
+            result and its density per km ('<result>PerKm'), one value per group
+        """
+        table = {
+            'group': self.labels[grouping],
+            'segments': self.counts[grouping],
+            'length_km': self.lengthSums[grouping],
+            }
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, value in self.sums[grouping].items():
+                table[name] = value
+                table[name + 'PerKm'] = np.where(self.lengthSums[grouping] > 0,
+                                                 value / self.lengthSums[grouping], 0.0)
+        return table
+
+#----------------
+#Example usage
+#---------------
+
+if __name__ == "__main__":
+    from benchmarkEncounters import syntheticNetwork
+    from networkEncountersGenerator import computeEncountersNetwork, RESULT_COLUMNS
+
+    nSegments = 100_000
+    rng = np.random.default_rng(0)
+    network = syntheticNetwork(nSegments)
+    results = computeEncountersNetwork(**network)
+    aggregation = EncounterAggregation({
+        'municipality': rng.integers(0, 350, nSegments),
+        'roadClass': rng.choice(['local', 'collector', 'arterial', 'motorway'], nSegments),
+        }, network['length_km'], {name: results[name] for name in RESULT_COLUMNS})
+    print(aggregation.table('roadClass'))
+
+    # New counts on 1% of the segments: recompute and update only those
+    changed = rng.choice(nSegments, nSegments // 100, replace=False)
+    changedNetwork = {name: np.asarray(value)[changed] for name, value in network.items()}
+    changedNetwork['intensiteit_heen_pae_per_dag'] = changedNetwork['intensiteit_heen_pae_per_dag'] * 1.1
+    changedResults = computeEncountersNetwork(**changedNetwork)
+    aggregation.update(changed, {name: changedResults[name] for name in RESULT_COLUMNS})
+    print(aggregation.table('roadClass')['totalEncountersHourPerKm'])
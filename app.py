@@ -5,8 +5,71 @@ Created on Wed Feb  4 11:20:17 2026
 @author: dvbezooijen
 """
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+import numpy as np
 import streamlit as st
 from roadEncountersGenerator import computeEncountersRoad  # adjust import
+from networkEncountersGenerator import computeEncountersNetwork, SEGMENT_COLUMNS
+
+# Parameters that can be swept, with the label of the input field
+SWEEP_PARAMETERS = {
+    'intensiteit_heen_pae_per_dag': 'Motor vehicle rate to (per day)',
+    'intensiteit_terug_pae_per_dag': 'Motor vehicle rate from (per day)',
+    'snelheid_heen_km_per_uur': 'Motor vehicle speed to (km/h)',
+    'snelheid_terug_km_per_uur': 'Motor vehicle speed from (km/h)',
+    'fiets_h': 'Cycling rate to (per day)',
+    'fiets_t': 'Cycling rate from (per day)',
+    'length_km': 'Road length (km)',
+    }
+MAX_SWEEPS = 32 #finished and running sweeps kept for all sessions
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def computeEncountersCached(*roadInputs):
+    """
+    computeEncountersRoad, cached on the form inputs (shared by all sessions).
+    """
+    return computeEncountersRoad(*roadInputs)
+
+
+@st.cache_resource
+def getSweepExecutor():
+    """
+    Process pool shared by all sessions, so sweeps run outside the UI thread.
+    Workers come from a forkserver: forking the threaded server could deadlock
+    and would copy its websocket connections into the workers.
+    """
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('forkserver'))
+
+
+@st.cache_resource
+def getSweeps():
+    """
+    Running and finished sweeps of all sessions, keyed on their inputs.
+    """
+    return OrderedDict(), threading.Lock()
+
+
+def submitSweep(roadInputs, parameter, values):
+    """
+    Start a sweep in the background, or reuse an identical one.
+    """
+    key = (roadInputs, parameter, tuple(values))
+    sweeps, lock = getSweeps()
+    with lock:
+        if key in sweeps:
+            sweeps.move_to_end(key)
+        else:
+            columns = dict(zip(SEGMENT_COLUMNS, roadInputs))
+            columns[parameter] = np.asarray(values, dtype=float)
+            sweeps[key] = getSweepExecutor().submit(computeEncountersNetwork, **columns)
+            while len(sweeps) > MAX_SWEEPS:
+                sweeps.popitem(last=False)
+    return key
 
 st.title("Road user encounter model")
 
@@ -56,19 +119,21 @@ length_km = st.number_input(
     "Road length (km)", min_value=0.0, value=1.0
 )
 
+roadInputs = (
+    aantal_rijstroken_heen,
+    aantal_rijstroken_terug,
+    intensiteit_heen,
+    intensiteit_terug,
+    snelheid_heen,
+    snelheid_terug,
+    fiets_h,
+    fiets_t,
+    fietsSpeedKmh,
+    length_km
+)
+
 if st.button("Compute encounters"):
-    results = computeEncountersRoad(
-        aantal_rijstroken_heen,
-        aantal_rijstroken_terug,
-        intensiteit_heen,
-        intensiteit_terug,
-        snelheid_heen,
-        snelheid_terug,
-        fiets_h,
-        fiets_t,
-        fietsSpeedKmh,
-        length_km
-    )
+    results = computeEncountersCached(*roadInputs)
 
     st.subheader("Results (per day)")
     st.metric(
@@ -81,3 +146,59 @@ if st.button("Compute encounters"):
     st.write(f"🚲🚗 Bike–MV: {results['bcEncountersHour']*24:.0f}")
     st.write(f"🚲🚲 Bike–Bike: {results['bbEncountersHour']*24:.0f}")
     st.write("Since the model outputs float point numbers, rounding errors may apply the the above results")
+
+st.header("Parameter sweep")
+st.write("Vary one input over a range, keeping the other road data fixed. The sweep runs in the background.")
+
+parameter = st.selectbox(
+    "Parameter", list(SWEEP_PARAMETERS), format_func=SWEEP_PARAMETERS.get
+)
+currentValue = float(roadInputs[SEGMENT_COLUMNS.index(parameter)])
+sweepStart = st.number_input("From", min_value=0.0, value=currentValue * 0.5)
+sweepStop = st.number_input("To", min_value=0.0, value=max(currentValue * 1.5, 1.0))
+sweepSteps = st.number_input("Steps", min_value=2, max_value=1000, value=21, step=1)
+
+if st.button("Run sweep"):
+    values = np.linspace(sweepStart, sweepStop, int(sweepSteps)).tolist()
+    st.session_state['sweep'] = submitSweep(roadInputs, parameter, values)
+
+
+def getSweep(key):
+    sweeps, lock = getSweeps()
+    with lock:
+        return sweeps.get(key)
+
+
+@st.fragment(run_every=1)
+def waitForSweep(key):
+    """
+    Polls a running sweep, and reruns the app once it is done so polling stops.
+    """
+    future = getSweep(key)
+    if future is None or future.done():
+        st.rerun()
+    st.info("Sweep running...")
+
+
+def showSweep(key):
+    future = getSweep(key)
+    if future is None:
+        st.warning("The sweep was evicted, please run it again")
+        return
+    if not future.done():
+        waitForSweep(key)
+        return
+    _, parameter, values = key
+    results = future.result()
+    st.subheader(f"Encounters per day versus {SWEEP_PARAMETERS[parameter].lower()}")
+    st.line_chart({
+        SWEEP_PARAMETERS[parameter]: values,
+        'Total': results['totalEncountersHour'] * 24,
+        'MV–MV': results['ccEncountersHour'] * 24,
+        'Bike–MV': results['bcEncountersHour'] * 24,
+        'Bike–Bike': results['bbEncountersHour'] * 24,
+    }, x=SWEEP_PARAMETERS[parameter])
+
+
+if st.session_state.get('sweep') is not None:
+    showSweep(st.session_state['sweep'])
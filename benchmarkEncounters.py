@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Benchmark suite for the hot paths of the encounter model.
+    Every scenario is timed over a number of repeats and reports the per-call
+    latency, the throughput in road segments per second and the peak memory
+    (tracemalloc) of one call. Results are saved as JSON, and a previous result
+    file can be passed to compare the latencies between versions.
+
+    With --cold-start the startup cost is measured as well: every cold start
+    scenario runs in a fresh interpreter and reports the process time, the
+    import time, the first-call and warm-call latency and which heavy optional
+    modules were loaded. The engine modules should only load NumPy.
+
+Usage:
+    python benchmarkEncounters.py --output bench.json
+    python benchmarkEncounters.py --output new.json --compare bench.json
+    python benchmarkEncounters.py --cold-start --repeat 10
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from encountersGenerator import expectedAlongProbability, solveRoadPieces
+from networkEncountersGenerator import computeEncountersNetwork, SEGMENT_COLUMNS
+from roadEncountersGenerator import computeEncountersRoad
+import numpy as np
+
+
+def syntheticNetwork(nSegments, seed=0):
+    """
+    Synthetic network of rural, urban and motorway-like road segments.
+    """
+    rng = np.random.default_rng(seed)
+    lanes = rng.choice([0, 1, 1, 1, 2, 3], nSegments)
+    cars = lanes > 0
+    return dict(
+        aantal_rijstroken_heen=lanes,
+        aantal_rijstroken_terug=lanes,
+        intensiteit_heen_pae_per_dag=np.round(rng.lognormal(8, 1, nSegments)) * cars,
+        intensiteit_terug_pae_per_dag=np.round(rng.lognormal(8, 1, nSegments)) * cars,
+        snelheid_heen_km_per_uur=rng.choice([30, 50, 60, 80, 100], nSegments),
+        snelheid_terug_km_per_uur=rng.choice([30, 50, 60, 80, 100], nSegments),
+        fiets_h=rng.choice([0, 0, 200, 2000], nSegments),
+        fiets_t=rng.choice([0, 0, 200, 2000], nSegments),
+        fietsSpeedKmh=np.full(nSegments, 18),
+        length_km=np.round(rng.uniform(0.02, 3, nSegments), 3),
+        )
+
+
+# Road segments of the scenarios, in the argument order of computeEncountersRoad
+RURAL_ROAD = (1, 0, 3000, 0, 80, 80, 0, 0, 18, 2.0)
+URBAN_ROAD = (2, 2, 12000, 11000, 50, 50, 3000, 2500, 18, 0.4)
+MOTORWAY_ROAD = (3, 3, 60000, 60000, 130, 130, 0, 0, 18, 10.0)
+
+
+def scenarios(networkSize):
+    """
+    Benchmark scenarios as (name, segments per call, callable).
+    """
+    network = syntheticNetwork(networkSize)
+    # Per-lane pair of the motorway, after group thinning
+    rateHour = 60000 / 24 / 3
+    rateHour = rateHour * np.exp(-(2/3600) * rateHour)
+    return [
+        ('rural single lane road', 1, lambda: computeEncountersRoad(*RURAL_ROAD)),
+        ('urban 2x2 road with cycle lanes', 1, lambda: computeEncountersRoad(*URBAN_ROAD)),
+        ('motorway 3x3, 10 km', 1, lambda: computeEncountersRoad(*MOTORWAY_ROAD)),
+        ('motorway roadPieces, linear solver', 1,
+         lambda: solveRoadPieces(rateHour, rateHour, 130, 10.0, 0.84, solver='linear')),
+        ('motorway roadPieces, bisection solver', 1,
+         lambda: solveRoadPieces(rateHour, rateHour, 130, 10.0, 0.84, solver='bisection')),
+        # the along probability itself, computeEncounters memoizes the quadrature result per pair
+        ('equal speed along probability, Monte Carlo', 1,
+         lambda: expectedAlongProbability(190, 190, 50, 0.5, method='montecarlo', rng=0)),
+        ('equal speed along probability, quadrature', 1,
+         lambda: expectedAlongProbability(190, 190, 50, 0.5)),
+        (f'synthetic network, {networkSize} segments', networkSize,
+         lambda: computeEncountersNetwork(**network)),
+        ]
+
+
+# Modules the engine should not load (optional dependencies of entry points)
+HEAVY_MODULES = ('streamlit', 'pandas', 'scipy', 'matplotlib', 'asyncio')
+
+# Cold start scenarios as (name, import code, first call code), each run in a fresh interpreter
+COLD_START_SCENARIOS = [
+    ('numpy only', 'import numpy as np', 'np.zeros(1)'),
+    ('road engine', 'from roadEncountersGenerator import computeEncountersRoad',
+     f'computeEncountersRoad(*{URBAN_ROAD})'),
+    ('network engine', 'from networkEncountersGenerator import computeEncountersNetwork',
+     f'computeEncountersNetwork(*{URBAN_ROAD})'),
+    ('worker pool, first chunk', 'from parallelRunner import computeEncountersParallel',
+     f'computeEncountersParallel({ {c: [v] for c, v in zip(SEGMENT_COLUMNS, URBAN_ROAD)} }, maxWorkers=2)'),
+    ('HTTP service module', 'import encounterService', 'pass'),
+    ]
+
+_COLD_START_CODE = """
+import json, sys, time
+startTime = time.perf_counter()
+{importCode}
+importTime = time.perf_counter()
+{callCode}
+firstCallTime = time.perf_counter()
+{callCode}
+warmCallTime = time.perf_counter()
+print(json.dumps({{
+    'importSeconds': importTime - startTime,
+    'firstCallSeconds': firstCallTime - importTime,
+    'warmCallSeconds': warmCallTime - firstCallTime,
+    'modules': len(sys.modules),
+    'heavyModules': [m for m in {heavyModules!r} if m in sys.modules],
+    }}))
+"""
+
+
+def runColdStart(name, importCode, callCode, repeat):
+    """
+    Startup cost of a scenario, median over repeat fresh interpreters.
+    """
+    code = _COLD_START_CODE.format(importCode=importCode, callCode=callCode, heavyModules=HEAVY_MODULES)
+    runs = []
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['processSeconds'] = time.perf_counter() - startTime
+        runs.append(run)
+    result = {'name': name}
+    for key in ('processSeconds', 'importSeconds', 'firstCallSeconds', 'warmCallSeconds'):
+        result[key] = float(np.median([run[key] for run in runs]))
+    result['modules'] = runs[-1]['modules']
+    result['heavyModules'] = runs[-1]['heavyModules']
+    result['repeat'] = repeat
+    return result
+
+
+def runBenchmark(name, nSegments, func, repeat):
+    """
+    Time func and measure the peak memory of one call.
+    """
+    func()  # warm up caches and imports
+    # Enough calls per repeat for a measurable duration
+    calls = 1
+    while True:
+        startTime = time.perf_counter()
+        for _ in range(calls):
+            func()
+        if time.perf_counter() - startTime > 0.2 or calls >= 10_000:
+            break
+        calls *= 10
+    latencies = []
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        for _ in range(calls):
+            func()
+        latencies.append((time.perf_counter() - startTime) / calls)
+
+    tracemalloc.start()
+    func()
+    peakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latency = float(np.median(latencies))
+    return {
+        'name': name,
+        'latencySeconds': latency,
+        'latencyMinSeconds': float(np.min(latencies)),
+        'segmentsPerSecond': nSegments / latency,
+        'peakMemoryBytes': peakBytes,
+        'callsPerRepeat': calls,
+        'repeat': repeat,
+        }
+
+
+def compareResults(results, previous):
+    """
+    Print the latency ratio (new / previous) per scenario.
+    """
+    for section, key in (('benchmarks', 'latencySeconds'), ('coldStart', 'processSeconds')):
+        previousByName = {r['name']: r for r in previous.get(section, [])}
+        for result in results.get(section, []):
+            old = previousByName.get(result['name'])
+            if old is None:
+                continue
+            ratio = result[key] / old[key]
+            print(f"{result['name']:45s} {ratio:6.2f}x {'slower' if ratio > 1 else 'faster'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the road encounter model.')
+    parser.add_argument('--output', default='benchmarkResults.json', help='JSON file for the results')
+    parser.add_argument('--compare', default=None, help='previous JSON results to compare with')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed repeats per scenario')
+    parser.add_argument('--network-size', type=int, default=100_000, help='segments of the synthetic network')
+    parser.add_argument('--cold-start', action='store_true', help='only measure import time and first-call latency')
+    args = parser.parse_args(argv)
+
+    coldStart = []
+    if args.cold_start:
+        for name, importCode, callCode in COLD_START_SCENARIOS:
+            result = runColdStart(name, importCode, callCode, args.repeat)
+            coldStart.append(result)
+            print(f"{name:30s} process {result['processSeconds']*1e3:8.1f} ms "
+                  f"import {result['importSeconds']*1e3:8.1f} ms "
+                  f"first call {result['firstCallSeconds']*1e3:8.1f} ms "
+                  f"warm call {result['warmCallSeconds']*1e3:8.2f} ms "
+                  f"heavy modules {result['heavyModules'] or '-'}")
+
+    benchmarks = []
+    for name, nSegments, func in ([] if args.cold_start else scenarios(args.network_size)):
+        result = runBenchmark(name, nSegments, func, args.repeat)
+        benchmarks.append(result)
+        print(f"{name:45s} {result['latencySeconds']*1e3:10.3f} ms "
+              f"{result['segmentsPerSecond']:12.0f} segments/s "
+              f"{result['peakMemoryBytes']/2**20:8.2f} MB")
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'benchmarks': benchmarks,
+        'coldStart': coldStart,
+        }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compareResults(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Bounded LRU cache around computeEncounters.
+    The same (rateA, rateB, speedA, speedB, length, threshold, groupWindow)
+    tuple occurs many times within a road (every lane of a direction has the
+    same rate) and across a network (standard speeds and lengths). Inputs are
+    quantized to a configurable number of significant digits, the quantized
+    inputs are used both as cache key and for the computation itself, so a
+    cached result is always identical to a fresh one.
+
+    The cache only stores results of the deterministic (quadrature) model and
+    can be saved to and loaded from a .npz file between batch runs. The file
+    records the model version and settings (encountersGenerator.modelSettings),
+    a file of another model version is not used.
+"""
+
+from collections import OrderedDict
+import json
+import os
+from encountersGenerator import computeEncountersArray, modelSettings
+from instrumentation import STATS
+import numpy as np
+
+# Order of the inputs in a cache key
+KEY_FIELDS = ('rateHourA', 'rateHourB', 'speedKmhA', 'speedKmhB',
+              'roadLengthKm', 'confidenceTreshold', 'groupWindow')
+
+
+def quantize(values, significantDigits):
+    """
+    Round values to a number of significant digits (None for no quantization).
+    """
+    values = np.asarray(values, dtype=float)
+    if significantDigits is None:
+        return values
+    with np.errstate(divide='ignore'):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    scale = 10.0 ** (significantDigits - 1 - np.where(np.isfinite(magnitude), magnitude, 0))
+    return np.round(values * scale) / scale
+
+
+def _fileModel(data):
+    # model settings of a saved cache, None for files from before they were recorded
+    return json.loads(str(data['model'])) if 'model' in data else None
+
+
+class EncounterCache:
+    """
+    LRU cache of computeEncounters results.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of cached lane pair results
+    significantDigits : int or None
+        Quantization of the inputs (None to use the exact inputs as key)
+    path : str or None
+        .npz file to load the cache from (if it exists and was written by the
+        current model version) and to save it to
+    """
+
+    def __init__(self, maxsize=1_000_000, significantDigits=6, path=None):
+        self.maxsize = maxsize
+        self.significantDigits = significantDigits
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+        if path is not None and os.path.exists(path):
+            #A cache of another model version holds stale results, start empty (it is replaced on save)
+            with np.load(path) as data:
+                currentModel = _fileModel(data) == modelSettings()
+            if currentModel:
+                self.load(path)
+
+    def __len__(self):
+        return len(self._results)
+
+    def computeEncounters(self, rateHourA, rateHourB, speedKmhA, speedKmhB,
+                          roadLengthKm, confidenceTreshold, groupWindow):
+        """
+        Cached form of encountersGenerator.computeEncounters for one stream pair.
+        """
+        enc = self.computeEncountersArray(rateHourA, rateHourB, speedKmhA, speedKmhB,
+                                          roadLengthKm, confidenceTreshold, groupWindow)
+        return {key: float(value) for key, value in enc.items()}
+
+    def computeEncountersArray(self, rateHourA, rateHourB, speedKmhA, speedKmhB,
+                               roadLengthKm, confidenceTreshold, groupWindow, computeAlong=True):
+        """
+        Cached form of encountersGenerator.computeEncountersArray.
+
+        Distinct inputs are looked up once, all misses are computed in a single
+        vectorized call and stored. Along results are cached for every pair and
+        zeroed afterwards where computeAlong is False.
+        """
+        inputs = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (
+            rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm, confidenceTreshold, groupWindow)))
+        shape = inputs[0].shape
+        keys = quantize(np.stack([x.ravel() for x in inputs], axis=1), self.significantDigits)
+        uniqueKeys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+
+        #Look up distinct inputs
+        values = np.empty((len(uniqueKeys), 2))
+        missing = []
+        for i, key in enumerate(map(tuple, uniqueKeys.tolist())):
+            value = self._results.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                self._results.move_to_end(key)
+                values[i] = value
+        self.misses += len(missing)
+        self.hits += len(uniqueKeys) - len(missing)
+        if STATS.enabled:
+            STATS.count('cacheHits', len(uniqueKeys) - len(missing))
+            STATS.count('cacheMisses', len(missing))
+
+        #Compute all misses at once, grouped by model settings
+        if missing:
+            missing = np.array(missing)
+            for settings in np.unique(uniqueKeys[missing, 5:], axis=0):
+                idx = missing[(uniqueKeys[missing, 5:] == settings).all(axis=1)]
+                enc = computeEncountersArray(*uniqueKeys[idx, :5].T, settings[0], settings[1])
+                values[idx, 0] = enc['Encounters (towards)']
+                values[idx, 1] = enc['Encounters (along)']
+            for i in missing:
+                self._store(tuple(uniqueKeys[i].tolist()), (values[i, 0], values[i, 1]))
+
+        values = values[inverse]
+        along = np.where(np.broadcast_to(computeAlong, shape).ravel(), values[:, 1], 0.0)
+        results = {
+            'Encounters (towards)': values[:, 0].reshape(shape),
+            'Encounters (along)': along.reshape(shape),
+            }
+        return results
+
+    def _store(self, key, value):
+        self._results[key] = value
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Hit/miss statistics of the cache (distinct inputs per call are counted once).
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'size': len(self._results),
+            'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        self._results.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def save(self, path=None):
+        """
+        Save the cached results (in LRU order) to a .npz file.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError('No path given to save the encounter cache to')
+        keys = np.array(list(self._results.keys()), dtype=float).reshape(-1, len(KEY_FIELDS))
+        values = np.array(list(self._results.values()), dtype=float).reshape(-1, 2)
+        #Write to a temporary file first, so an interrupted save keeps the old cache
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, keys=keys, values=values,
+                     significantDigits=-1 if self.significantDigits is None else self.significantDigits,
+                     model=json.dumps(modelSettings(), sort_keys=True))
+        os.replace(path + '.tmp', path)
+
+    def load(self, path):
+        """
+        Load cached results from a .npz file written by save.
+        """
+        with np.load(path) as data:
+            significantDigits = int(data['significantDigits'])
+            if significantDigits != (-1 if self.significantDigits is None else self.significantDigits):
+                raise ValueError(f'Cache file {path} was written with a different quantization')
+            if _fileModel(data) != modelSettings():
+                raise ValueError(f'Cache file {path} was written by another model version '
+                                 f'({_fileModel(data)}, current {modelSettings()})')
+            for key, value in zip(data['keys'].tolist(), data['values'].tolist()):
+                self._store(tuple(key), tuple(value))
+
+#------------
+#Example usage
+#-----------
+if __name__ == "__main__":
+    cache = EncounterCache(maxsize=10_000)
+    for _ in range(3):
+        results = cache.computeEncounters(190, 190, 50, 50, 0.083412195401082009, 0.84, 0)
+    print(results)
+    print(cache.stats())
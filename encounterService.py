@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Lightweight HTTP batch service for the road encounter model (asyncio,
+    standard library only).
+    Concurrent requests that arrive within a short time window are coalesced
+    into one computeEncountersNetwork batch, which runs in a process pool so
+    the event loop keeps accepting requests.
+
+Endpoints:
+    POST /encounters
+        {"segments": [{"aantal_rijstroken_heen": 1, ..., "length_km": 0.5}, ...]}
+        -> {"results": [{"totalEncountersHour": ..., ...}, ...]}
+        Segments have the SEGMENT_COLUMNS of networkEncountersGenerator.
+    GET /metrics
+        Request, batch and segment counts, latency percentiles and throughput
+    GET /health
+
+Usage:
+    python encounterService.py --host 0.0.0.0 --port 8000
+"""
+
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import time
+from networkEncountersGenerator import computeEncountersNetwork, SEGMENT_COLUMNS, RESULT_COLUMNS
+import numpy as np
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+MAX_BODY_BYTES = 64 * 2**20
+
+# Segment fields that must be whole numbers
+LANE_COLUMNS = ('aantal_rijstroken_heen', 'aantal_rijstroken_terug')
+
+# Speed fields -> the rates that drive at that speed; a speed must be > 0
+# when one of its rates is > 0, the model divides by it
+SPEED_RATES = {
+    'snelheid_heen_km_per_uur': ('intensiteit_heen_pae_per_dag',),
+    'snelheid_terug_km_per_uur': ('intensiteit_terug_pae_per_dag',),
+    'fietsSpeedKmh': ('fiets_h', 'fiets_t'),
+    }
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _computeBatch(columns):
+    """
+    Work unit of a worker process: one coalesced batch of segments.
+    """
+    results = computeEncountersNetwork(*columns)
+    return [results[name] for name in RESULT_COLUMNS]
+
+
+def parseSegments(body):
+    """
+    Segment columns (in SEGMENT_COLUMNS order) of a POST /encounters body.
+    """
+    try:
+        segments = json.loads(body)['segments']
+        columns = np.array([[float(segment[c]) for c in SEGMENT_COLUMNS] for segment in segments],
+                           dtype=float).reshape(-1, len(SEGMENT_COLUMNS)).T
+    except (ValueError, KeyError, TypeError) as error:
+        raise RequestError(400, f'Expected {{"segments": [...]}} with the fields {list(SEGMENT_COLUMNS)}: {error!r}')
+
+    #Values the model cannot compute, rejected instead of answered with NaN or wrong results
+    segments = dict(zip(SEGMENT_COLUMNS, columns))
+    checks = [(name, ~np.isfinite(column) | (column < 0), 'finite and non-negative')
+              for name, column in segments.items()]
+    checks += [(name, segments[name] % 1 != 0, 'a whole number') for name in LANE_COLUMNS]
+    checks += [(name, (segments[name] <= 0) & np.any([segments[rate] > 0 for rate in rates], axis=0),
+                f'positive when {" or ".join(rates)} is positive') for name, rates in SPEED_RATES.items()]
+    checks.append(('length_km', segments['length_km'] <= 0, 'positive'))
+    for name, invalid, requirement in checks:
+        if invalid.any():
+            raise RequestError(400, f'{name} must be {requirement}, '
+                                    f'invalid in segments {np.flatnonzero(invalid)[:10].tolist()}')
+    return columns
+
+
+class EncounterService:
+    """
+    Request coalescing and metrics of the HTTP service.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Executor for the model computations
+    windowSeconds : float
+        Time to wait for more requests after the first request of a batch
+    maxBatchSegments : int
+        Maximum number of segments per batch
+    maxConcurrentBatches : int
+        Maximum number of batches computed at the same time
+    """
+
+    def __init__(self, executor, windowSeconds=0.005, maxBatchSegments=50_000, maxConcurrentBatches=None):
+        self.executor = executor
+        self.windowSeconds = windowSeconds
+        self.maxBatchSegments = maxBatchSegments
+        self.maxConcurrentBatches = maxConcurrentBatches or os.cpu_count()
+        self.queue = asyncio.Queue()
+        self.startTime = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.segments = 0
+        self.latencies = deque(maxlen=10_000)
+        self._batcher = None
+
+    def start(self):
+        self._slots = asyncio.Semaphore(self.maxConcurrentBatches)
+        self._batcher = asyncio.create_task(self._collectBatches())
+
+    async def compute(self, columns):
+        """
+        Compute encounters for the segment columns of one request.
+        """
+        if columns.shape[1] == 0:
+            return [np.zeros(0) for _ in RESULT_COLUMNS]
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((columns, future))
+        return await future
+
+    async def _collectBatches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            nSegments = batch[0][0].shape[1]
+            #Coalesce the requests that arrive within the window
+            deadline = loop.time() + self.windowSeconds
+            while nSegments < self.maxBatchSegments:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                nSegments += item[0].shape[1]
+            await self._slots.acquire()
+            asyncio.create_task(self._computeBatch(batch))
+
+    async def _computeBatch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            columns = np.concatenate([columns for columns, _ in batch], axis=1)
+            results = await loop.run_in_executor(self.executor, _computeBatch, columns)
+            self.batches += 1
+            self.segments += columns.shape[1]
+            start = 0
+            for requestColumns, future in batch:
+                stop = start + requestColumns.shape[1]
+                if not future.cancelled():
+                    future.set_result([r[start:stop] for r in results])
+                start = stop
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            self._slots.release()
+
+    def metrics(self):
+        elapsed = max(time.time() - self.startTime, 1e-9)
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'batches': self.batches,
+            'segments': self.segments,
+            'meanSegmentsPerBatch': self.segments / self.batches if self.batches else 0.0,
+            'queuedRequests': self.queue.qsize(),
+            'uptimeSeconds': elapsed,
+            'segmentsPerSecond': self.segments / elapsed,
+            'latencySeconds': {
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max()),
+                },
+            }
+
+    async def handle(self, method, path, body):
+        """
+        Response status and JSON payload of one HTTP request.
+        """
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.metrics()
+        if path != '/encounters':
+            raise RequestError(404, f'Unknown path {path}')
+        if method != 'POST':
+            raise RequestError(405, 'Use POST for /encounters')
+
+        startTime = time.perf_counter()
+        columns = parseSegments(body)
+        results = await self.compute(columns)
+        payload = {'results': [dict(zip(RESULT_COLUMNS, values))
+                               for values in zip(*(r.tolist() for r in results))]}
+        self.latencies.append(time.perf_counter() - startTime)
+        return 200, payload
+
+    async def serveConnection(self, reader, writer):
+        """
+        Minimal HTTP/1.1 connection handler with keep-alive.
+        """
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine.strip():
+                    break
+                method, path, _ = requestLine.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                self.requests += 1
+                try:
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_BODY_BYTES:
+                        raise RequestError(413, f'Request body larger than {MAX_BODY_BYTES} bytes')
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self.handle(method, path.split('?')[0], body)
+                except RequestError as error:
+                    self.errors += 1
+                    status, payload = error.status, {'error': str(error)}
+                except Exception as error:
+                    self.errors += 1
+                    status, payload = 500, {'error': repr(error)}
+
+                keepAlive = headers.get('connection', '').lower() != 'close'
+                try:
+                    data = json.dumps(payload, allow_nan=False).encode()
+                except ValueError as error:
+                    # NaN or infinite results are not valid JSON
+                    self.errors += 1
+                    status, data = 500, json.dumps({'error': repr(error)}).encode()
+                writer.write(
+                    f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+                    f'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n'
+                    f'Connection: {"keep-alive" if keepAlive else "close"}\r\n\r\n'.encode() + data)
+                await writer.drain()
+                if not keepAlive or status == 413:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8000, workers=None, windowSeconds=0.005, maxBatchSegments=50_000):
+    # workers start lazily on the first batch; forked workers would inherit the
+    # client sockets accepted by then and keep those connections open
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver')) as executor:
+        service = EncounterService(executor, windowSeconds, maxBatchSegments, workers)
+        service.start()
+        server = await asyncio.start_server(service.serveConnection, host, port)
+        print(f'Serving road encounters on http://{host}:{port}', flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP batch service for the road encounter model.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (0.0.0.0 in a container)')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--window-ms', type=float, default=5, help='coalescing window for concurrent requests')
+    parser.add_argument('--max-batch', type=int, default=50_000, help='maximum segments per batch')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.window_ms / 1000, args.max_batch))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Table mode for network-scale and sensitivity runs.
+    computeEncounters is precomputed once on a grid of per-lane rates (A and B),
+    speeds (A and B) and road lengths and stored as a memory mapped .npy file,
+    with the grid axes and model settings in a .json file next to it. Queries
+    are answered by multilinear interpolation between the 32 surrounding grid
+    points, so every lane pair costs a few array lookups.
+
+    Next to the interpolated encounters an error bound is reported: the spread
+    (max - min) of the grid values around the query. This bounds the
+    interpolation error where the model is monotone within a grid cell. Note
+    that the along encounters jump where speedKmhA == speedKmhB, so speed
+    pairs should be on grid values (e.g. the standard speed limits).
+    A table can only be opened by the model version that built it.
+"""
+
+import json
+import os
+from encountersGenerator import computeEncountersArray, modelSettings
+import numpy as np
+
+# Grid axes of a table, in the order of the table dimensions
+TABLE_AXES = ('rateHourA', 'rateHourB', 'speedKmhA', 'speedKmhB', 'roadLengthKm')
+
+
+def _axesPath(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def buildEncounterTable(path, rateHourGrid, speedKmhGrid, roadLengthKmGrid,
+                        confidenceTreshold=0.84, groupWindow=2, progress=None):
+    """
+    Precompute computeEncounters on a grid and store it as a table.
+
+    Parameters
+    ----------
+    path : str
+        Output .npy file; the axes are written to a .json file with the same name
+    rateHourGrid : array_like
+        Increasing per-lane rates [vehicles per hour], used for stream A and B
+    speedKmhGrid : array_like
+        Increasing speeds [km/h], used for stream A and B
+    roadLengthKmGrid : array_like
+        Increasing road lengths [km]
+    confidenceTreshold : float
+        Minimum confidence threshold for splitting road into analysis pieces
+    groupWindow : float
+        Time window in seconds for group-thinning of arrivals
+    progress : callable or None
+        Called as progress(doneRows, totalRows) after every rate of stream A
+
+    Returns
+    -------
+    table : EncounterTable
+    """
+    axes = [np.asarray(rateHourGrid, dtype=float), np.asarray(rateHourGrid, dtype=float),
+            np.asarray(speedKmhGrid, dtype=float), np.asarray(speedKmhGrid, dtype=float),
+            np.asarray(roadLengthKmGrid, dtype=float)]
+    for name, axis in zip(TABLE_AXES, axes):
+        if axis.ndim != 1 or axis.size < 2 or np.any(np.diff(axis) <= 0):
+            raise ValueError(f'Grid of {name} must be increasing with at least 2 values')
+
+    shape = tuple(axis.size for axis in axes)
+    values = np.lib.format.open_memmap(path, mode='w+', dtype=float, shape=shape + (2,))
+    #One rate of stream A at a time, so memory stays bounded by the other axes
+    rest = np.meshgrid(*axes[1:], indexing='ij')
+    for i, rateHourA in enumerate(axes[0]):
+        enc = computeEncountersArray(rateHourA, *rest, confidenceTreshold, groupWindow)
+        values[i, ..., 0] = enc['Encounters (towards)']
+        values[i, ..., 1] = enc['Encounters (along)']
+        if progress is not None:
+            progress(i + 1, shape[0])
+    values.flush()
+    del values
+
+    with open(_axesPath(path), 'w') as f:
+        json.dump({
+            'axes': {name: axis.tolist() for name, axis in zip(TABLE_AXES, axes)},
+            'confidenceTreshold': confidenceTreshold,
+            'groupWindow': groupWindow,
+            'model': modelSettings(),
+            }, f)
+    return EncounterTable(path)
+
+
+class EncounterTable:
+    """
+    Precomputed encounter table, opened as a memory mapped array.
+
+    Parameters
+    ----------
+    path : str
+        .npy file written by buildEncounterTable
+    """
+
+    def __init__(self, path):
+        with open(_axesPath(path)) as f:
+            meta = json.load(f)
+        if meta.get('model') != modelSettings():
+            raise ValueError(f'Table {path} was built by another model version ({meta.get("model")}, '
+                             f'current {modelSettings()}), rebuild it with buildEncounterTable')
+        self.axes = [np.array(meta['axes'][name]) for name in TABLE_AXES]
+        self.confidenceTreshold = meta['confidenceTreshold']
+        self.groupWindow = meta['groupWindow']
+        self.values = np.load(path, mmap_mode='r')
+
+    def computeEncountersArray(self, rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm,
+                               confidenceTreshold=None, groupWindow=None, computeAlong=True):
+        """
+        Interpolated form of encountersGenerator.computeEncountersArray.
+
+        The model settings must match the settings the table was built with.
+        Next to the encounters, the results contain 'Error bound (towards)' and
+        'Error bound (along)' per pair.
+        """
+        if confidenceTreshold is not None and confidenceTreshold != self.confidenceTreshold:
+            raise ValueError(f'Table was built with confidenceTreshold={self.confidenceTreshold}')
+        if groupWindow is not None and groupWindow != self.groupWindow:
+            raise ValueError(f'Table was built with groupWindow={self.groupWindow}')
+
+        queries = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (
+            rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm)))
+        shape = queries[0].shape
+
+        #Grid cell and interpolation weight along every axis
+        lower, weight = [], []
+        for name, axis, query in zip(TABLE_AXES, self.axes, queries):
+            query = query.ravel()
+            if np.any((query < axis[0]) | (query > axis[-1])):
+                raise ValueError(f'{name} outside of the table range [{axis[0]}, {axis[-1]}]')
+            i = np.clip(np.searchsorted(axis, query, side='right') - 1, 0, axis.size - 2)
+            lower.append(i)
+            weight.append((query - axis[i]) / (axis[i+1] - axis[i]))
+
+        #Weighted sum over the 2^5 corners of the cell
+        nQueries = lower[0].size
+        interpolated = np.zeros((nQueries, 2))
+        cornerMin = np.full((nQueries, 2), np.inf)
+        cornerMax = np.full((nQueries, 2), -np.inf)
+        for corner in range(2 ** len(TABLE_AXES)):
+            index, cornerWeight = [], np.ones(nQueries)
+            for d in range(len(TABLE_AXES)):
+                upper = (corner >> d) & 1
+                index.append(lower[d] + upper)
+                cornerWeight = cornerWeight * (weight[d] if upper else 1 - weight[d])
+            cornerValues = self.values[tuple(index)]
+            interpolated += cornerWeight[:, None] * cornerValues
+            cornerMin = np.minimum(cornerMin, cornerValues)
+            cornerMax = np.maximum(cornerMax, cornerValues)
+
+        computeAlong = np.broadcast_to(np.asarray(computeAlong, dtype=bool), shape).ravel()
+        errorBound = cornerMax - cornerMin
+        results = {
+            'Encounters (towards)': interpolated[:, 0].reshape(shape),
+            'Encounters (along)': np.where(computeAlong, interpolated[:, 1], 0.0).reshape(shape),
+            'Error bound (towards)': errorBound[:, 0].reshape(shape),
+            'Error bound (along)': np.where(computeAlong, errorBound[:, 1], 0.0).reshape(shape),
+            }
+        return results
+
+#------------
+#Example usage
+#-----------
+if __name__ == "__main__":
+    import time
+
+    startTime = time.time()
+    table = buildEncounterTable(
+        'encounterTable.npy',
+        rateHourGrid=np.concatenate([[0], np.geomspace(1, 2000, 40)]),
+        speedKmhGrid=[15, 18, 30, 50, 60, 80, 100, 130],
+        roadLengthKmGrid=np.geomspace(0.01, 10, 40),
+        )
+    print(f'Building the table took {time.time() - startTime:.1f} s')
+
+    enc = table.computeEncountersArray(190, 190, 50, 50, 0.083412195401082009)
+    print(enc)
+    print(computeEncountersArray(190, 190, 50, 50, 0.083412195401082009, 0.84, 2))
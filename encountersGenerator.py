@@ -5,6 +5,228 @@
 
 import numpy as np
 import time
+from functools import lru_cache
+from instrumentation import STATS
+
+# Version of the model results, increase it with every change that alters the results
+#   1: original model
+#   2: along encounters of computeEncountersRoad no longer alias the towards encounters
+MODEL_VERSION = '2'
+
+def pieceConfidence(rateHourA, rateHourB, speedKmh, roadLengthKm, roadPieces):
+    """
+    State confidence of a road split into roadPieces analysis pieces.
+    
+    This is the probability that neither stream holds more than one vehicle
+    on a piece, i.e. the sum of the (0,1) x (0,1) Poisson state grid. It
+    increases monotonically with roadPieces, towards 1.
+    """
+    analysisLengthKm = roadLengthKm / roadPieces #analysis length of a piece of road [km]
+    dwellTimeStateHour = analysisLengthKm/speedKmh
+    xA = rateHourA*dwellTimeStateHour
+    xB = rateHourB*dwellTimeStateHour
+    pA0, pA1 = np.exp(-xA), xA*np.exp(-xA)
+    pB0, pB1 = np.exp(-xB), xB*np.exp(-xB)
+    return pA0*pB0 + pA0*pB1 + pA1*pB0 + pA1*pB1
+
+
+def solveRoadPieces(rateHourA, rateHourB, speedKmh, roadLengthKm, confidenceTreshold, solver='bisection'):
+    """
+    Smallest number of road pieces for which pieceConfidence reaches confidenceTreshold.
+    
+    Works on scalars as well as arrays of stream pairs. The 'linear' solver
+    advances the piece count one step at a time, the 'bisection' solver uses an
+    exponential search followed by a bisection on the monotone confidence, which
+    takes O(log n) steps and gives the same piece count.
+    
+    Parameters
+    ----------
+    rateHourA, rateHourB : array_like
+        (Thinned) arrival rates of stream A and B [vehicles per hour]
+    speedKmh : array_like
+        Speed of the slowest stream [km/h]
+    roadLengthKm : array_like
+        Total road segment length [km]
+    confidenceTreshold : float
+        Minimum confidence threshold for splitting road into analysis pieces
+    solver : str
+        'bisection' or 'linear'
+    
+    Returns
+    -------
+    roadPieces : ndarray of int
+        Number of analysis pieces per stream pair
+    """
+    with STATS.timer('roadPieces'):
+        return _solveRoadPieces(rateHourA, rateHourB, speedKmh, roadLengthKm, confidenceTreshold, solver)
+
+
+def _solveRoadPieces(rateHourA, rateHourB, speedKmh, roadLengthKm, confidenceTreshold, solver):
+    rateHourA, rateHourB, speedKmh, roadLengthKm = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (rateHourA, rateHourB, speedKmh, roadLengthKm)))
+    shape = rateHourA.shape
+    rateHourA, rateHourB, speedKmh, roadLengthKm = (
+        x.ravel() for x in (rateHourA, rateHourB, speedKmh, roadLengthKm))
+    if STATS.enabled:
+        STATS.count('solverPairs', rateHourA.size)
+    
+    def notReached(idx, pieces):
+        if STATS.enabled:
+            STATS.count('solverIterations')
+            STATS.count('solverEvaluations', idx.size)
+        confidence = pieceConfidence(rateHourA[idx], rateHourB[idx], speedKmh[idx], roadLengthKm[idx], pieces)
+        return confidence < confidenceTreshold
+    
+    if solver == 'linear':
+        roadPieces = np.ones(rateHourA.size, dtype=np.int64)
+        active = np.arange(rateHourA.size)
+        while active.size:
+            active = active[notReached(active, roadPieces[active])]
+            roadPieces[active] += 1
+        return roadPieces.reshape(shape)
+    
+    if solver != 'bisection':
+        raise ValueError(f"Unknown solver '{solver}', use 'bisection' or 'linear'")
+    
+    # Exponential search: lower stays below the treshold, upper reaches it
+    lower = np.zeros(rateHourA.size, dtype=np.int64)
+    upper = np.ones(rateHourA.size, dtype=np.int64)
+    active = np.arange(rateHourA.size)
+    while active.size:
+        active = active[notReached(active, upper[active])]
+        lower[active] = upper[active]
+        upper[active] *= 2
+    
+    # Bisection between lower (not reached) and upper (reached)
+    active = np.flatnonzero(upper - lower > 1)
+    while active.size:
+        middle = (lower[active] + upper[active]) // 2
+        below = notReached(active, middle)
+        lower[active[below]] = middle[below]
+        upper[active[~below]] = middle[~below]
+        active = active[upper[active] - lower[active] > 1]
+    
+    return upper.reshape(shape)
+
+
+# Settings of the equal-speed expectation
+STD_SPEEDS = 0.10 #relative standard deviation of the speed of stream A
+QUADRATURE_NODES = 32 #Gauss-Legendre nodes per side of the mean speed
+QUADRATURE_RANGE = 8 #integration range in standard deviations
+
+
+def modelSettings():
+    """
+    Model version and model settings that determine the results, recorded in
+    files that store results (encounter cache, encounter table, result store).
+    """
+    return {
+        'modelVersion': MODEL_VERSION,
+        'stdSpeeds': STD_SPEEDS,
+        'quadratureNodes': QUADRATURE_NODES,
+        'quadratureRange': QUADRATURE_RANGE,
+        }
+
+
+def alongProbability(rateHourA, rateHourB, speedKmhA, speedKmhB, analysisLengthKm):
+    """
+    Probability of an along encounter on one analysis piece for given speeds.
+    
+    Stream A reaches stream B within the time window it gains (or loses) over
+    the analysis length. Rates must not both be zero.
+    """
+    timeWindowA = np.clip(analysisLengthKm*(1/speedKmhA - 1/speedKmhB), 0, None)
+    timeWindowB = np.clip(analysisLengthKm*(1/speedKmhB - 1/speedKmhA), 0, None)
+    probAB = (rateHourA/(rateHourA+rateHourB)) * (timeWindowA*rateHourB)*np.exp(-timeWindowA*rateHourB)
+    probBA = (rateHourB/(rateHourA+rateHourB)) * (timeWindowB*rateHourA)*np.exp(-timeWindowB*rateHourA)
+    return probAB + probBA
+
+
+@lru_cache(maxsize=None)
+def _quadratureRule(nNodes, stdRange):
+    """
+    Nodes (in standard deviations) and weights for E[f(Z)], Z standard normal.
+    
+    Both sides of the mean are integrated separately with Gauss-Legendre, because
+    the along probability has a kink where the speeds of both streams are equal.
+    Plain Gauss-Hermite converges only slowly over such a kink.
+    """
+    x, w = np.polynomial.legendre.leggauss(nNodes)
+    half = stdRange/2 * (x + 1)
+    halfWeights = stdRange/2 * w * np.exp(-half**2/2) / np.sqrt(2*np.pi)
+    nodes = np.concatenate([-half, half])
+    weights = np.concatenate([halfWeights, halfWeights])
+    nodes.flags.writeable = False
+    weights.flags.writeable = False
+    return nodes, weights
+
+
+def expectedAlongProbability(rateHourA, rateHourB, speedKmh, analysisLengthKm,
+                             stdSpeeds=STD_SPEEDS, method='quadrature', nSamples=10_000, rng=None):
+    """
+    Expected along probability of two streams with the same mean speed.
+    
+    The speed of stream A is normally distributed around speedKmh (clipped at
+    1 km/h), stream B drives at speedKmh.
+    
+    Parameters
+    ----------
+    rateHourA, rateHourB : array_like
+        (Thinned) arrival rates of stream A and B [vehicles per hour], not both zero
+    speedKmh : array_like
+        Mean speed of both streams [km/h]
+    analysisLengthKm : array_like
+        Length of an analysis piece [km]
+    stdSpeeds : float
+        Relative standard deviation of the speed of stream A
+    method : str
+        'quadrature' (default, deterministic) or 'montecarlo'
+    nSamples : int
+        Number of Monte Carlo samples
+    rng : None, int or numpy.random.Generator
+        Seed or generator for the Monte Carlo samples
+    
+    Returns
+    -------
+    encProbAlong : ndarray
+        Expected along probability per stream pair
+    """
+    rateHourA, rateHourB, speedKmh, analysisLengthKm = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (rateHourA, rateHourB, speedKmh, analysisLengthKm)))
+    shape = rateHourA.shape
+    rateHourA, rateHourB, speedKmh, analysisLengthKm = (
+        x.ravel()[:, None] for x in (rateHourA, rateHourB, speedKmh, analysisLengthKm))
+    
+    if STATS.enabled:
+        STATS.count(method + 'Invocations')
+        STATS.count(method + 'Pairs', rateHourA.shape[0])
+    
+    if method == 'quadrature':
+        draws, weights = _quadratureRule(QUADRATURE_NODES, QUADRATURE_RANGE)
+    elif method == 'montecarlo':
+        draws = np.random.default_rng(rng).standard_normal(nSamples)
+        weights = np.full(nSamples, 1/nSamples)
+    else:
+        raise ValueError(f"Unknown method '{method}', use 'quadrature' or 'montecarlo'")
+    
+    # Evaluate in chunks so that the (pairs x draws) grid stays bounded
+    encProbAlong = np.empty(rateHourA.shape[0])
+    chunkSize = max(1, 2_000_000 // draws.size)
+    with STATS.timer('alongProbability'):
+        for start in range(0, encProbAlong.size, chunkSize):
+            chunk = slice(start, start + chunkSize)
+            speedsKmhDrawnA = np.clip(speedKmh[chunk] * (1 + stdSpeeds*draws), 1, None)
+            probs = alongProbability(rateHourA[chunk], rateHourB[chunk], speedsKmhDrawnA,
+                                     speedKmh[chunk], analysisLengthKm[chunk])
+            encProbAlong[chunk] = probs @ weights
+    
+    return encProbAlong.reshape(shape)
+
+
+@lru_cache(maxsize=65_536)
+def _expectedAlongProbabilityCached(rateHourA, rateHourB, speedKmh, analysisLengthKm, stdSpeeds):
+    return float(expectedAlongProbability(rateHourA, rateHourB, speedKmh, analysisLengthKm, stdSpeeds))
+
 
 def computeEncounters(rateHourA:float,
                       rateHourB:float,
@@ -13,6 +235,10 @@ def computeEncounters(rateHourA:float,
                       roadLengthKm:float,
                       confidenceTreshold:float,
                       groupWindow: float,
+                      solver: str = 'bisection',
+                      alongMethod: str = 'quadrature',
+                      nSamples: int = 10_000,
+                      rng = None,
                       ):
     """
     Compute expected encounter rates between two traffic streams on a road segment.
@@ -21,7 +247,9 @@ def computeEncounters(rateHourA:float,
     more than one vehicle per lane falls within the user-specified confidence
     interval. Probabilities of encounters along and towards each other are
     calculated based on Poisson arrival rates, vehicle speeds, and lane lengths.
-    Monte Carlo simulation is used if both streams have identical speeds.
+    If both streams have identical speeds, the along probability is averaged
+    over a normal speed distribution of stream A, by quadrature (memoized) or
+    by Monte Carlo simulation.
     
     Parameters
     ----------
@@ -39,6 +267,15 @@ def computeEncounters(rateHourA:float,
         Minimum confidence threshold for splitting road into analysis pieces
     groupWindow : float
         Time window in seconds for group-thinning of arrivals (0 for no thinning)
+    solver : str
+        'bisection' (default) or 'linear' search for the number of road pieces,
+        see solveRoadPieces
+    alongMethod : str
+        'quadrature' (default, deterministic) or 'montecarlo' for equal speeds
+    nSamples : int
+        Number of Monte Carlo samples
+    rng : None, int or numpy.random.Generator
+        Seed or generator for the Monte Carlo samples
     
     Returns
     -------
@@ -48,10 +285,8 @@ def computeEncounters(rateHourA:float,
             - 'Encounters (along)': expected encounters along each other per hour
     """
     
-    # Initialize variable for while loop
-    roadPieces = 1
     # Input paramters for range of observable vehicles on the road, limited to known state space (max 1 veh per side)
-    vehObsA = [0,1]
+    vehObsA = np.arange(0,2)
     vehObsB = vehObsA #Must be symetric
     speedKmh = np.minimum(speedKmhA,speedKmhB) #slowest moving vehicle decided temporal state
     
@@ -59,33 +294,21 @@ def computeEncounters(rateHourA:float,
     rateHourA = rateHourA * np.exp(-(groupWindow/3600)*rateHourA)
     rateHourB = rateHourB * np.exp(-(groupWindow/3600)*rateHourB)
     
-    while True:
-        # Calculate neccesary input parameters
-        analysisLengthKm = roadLengthKm / roadPieces #analysis length of a piece of road [km]
+    # Smallest number of road pieces for which the state confidence reaches the treshold
+    roadPieces = int(solveRoadPieces(rateHourA, rateHourB, speedKmh, roadLengthKm, confidenceTreshold, solver))
     
-        #The maximum dwell time in a state (slowest vehicle)
-        dwellTimeStateHour = analysisLengthKm/speedKmh
-        
-        # Set state space (output [0,1])
-        vehObsA = np.arange(0,2)
-        vehObsB = np.arange(0,2)
-        
-        #Calculate probability of N(1,1) vector wize
-        pA = ((rateHourA*dwellTimeStateHour) ** vehObsA) * np.exp(-rateHourA*dwellTimeStateHour)
-        pB = ((rateHourB*dwellTimeStateHour) ** vehObsB) * np.exp(-rateHourB*dwellTimeStateHour)
-        
-        #Calculate the pairwise probabilities
-        probGrid = np.outer(pA, pB)
-        
-        #Calculate state confidence (state treshold)
-        confidence = np.sum(probGrid)
-        
-        # Check if confidence falls within treshold
-        if confidence >= confidenceTreshold:
-            break
-        
-        #Otherswise advance loop
-        roadPieces += 1
+    # Calculate neccesary input parameters
+    analysisLengthKm = roadLengthKm / roadPieces #analysis length of a piece of road [km]
+
+    #The maximum dwell time in a state (slowest vehicle)
+    dwellTimeStateHour = analysisLengthKm/speedKmh
+    
+    #Calculate probability of N(1,1) vector wize
+    pA = ((rateHourA*dwellTimeStateHour) ** vehObsA) * np.exp(-rateHourA*dwellTimeStateHour)
+    pB = ((rateHourB*dwellTimeStateHour) ** vehObsB) * np.exp(-rateHourB*dwellTimeStateHour)
+    
+    #Calculate the pairwise probabilities
+    probGrid = np.outer(pA, pB)
     
     """
     When the road is split into its analysis length pieces, the number of encounters for each piece
@@ -107,20 +330,14 @@ def computeEncounters(rateHourA:float,
             encProbAlong = 0.0
     
     elif speedKmhA == speedKmhB:
-        if rateHourA + rateHourB > 0:  # Monte Carlo simulation only if non-zero rates
-            nSamples = 10_000
-            stdSpeeds = 0.10
-            speedsKmhDrawnA = np.random.normal(speedKmhA, speedKmhA*stdSpeeds, nSamples)
-            speedsKmhDrawnA = np.clip(speedsKmhDrawnA, 1, None)
-            timeWindowsA = analysisLengthKm*(1/speedsKmhDrawnA - 1/speedKmhB)
-            timeWindowsB = analysisLengthKm*(1/speedKmhB - 1/speedsKmhDrawnA)
-            timeWindowsA = np.clip(timeWindowsA, 0, None)
-            timeWindowsB = np.clip(timeWindowsB, 0, None)
-    
-            probsAB = (rateHourA/(rateHourA+rateHourB)) * (timeWindowsA*rateHourB) * np.exp(-timeWindowsA*rateHourB)
-            probsBA = (rateHourB/(rateHourA+rateHourB)) * (timeWindowsB*rateHourA) * np.exp(-timeWindowsB*rateHourA)
-            probs = probsAB + probsBA
-            encProbAlong = np.mean(probs)
+        if rateHourA + rateHourB > 0:  # only calculate if rates are non-zero
+            if alongMethod == 'quadrature':
+                encProbAlong = _expectedAlongProbabilityCached(
+                    float(rateHourA), float(rateHourB), float(speedKmhA), float(analysisLengthKm), STD_SPEEDS)
+            else:
+                encProbAlong = float(expectedAlongProbability(
+                    rateHourA, rateHourB, speedKmhA, analysisLengthKm,
+                    method=alongMethod, nSamples=nSamples, rng=rng))
         else:
             encProbAlong = 0.0
 
@@ -147,6 +364,115 @@ def computeEncounters(rateHourA:float,
     
     return results
 
+def computeEncountersArray(rateHourA,
+                           rateHourB,
+                           speedKmhA,
+                           speedKmhB,
+                           roadLengthKm,
+                           confidenceTreshold:float,
+                           groupWindow: float,
+                           nSamples: int = 10_000,
+                           solver: str = 'bisection',
+                           alongMethod: str = 'quadrature',
+                           rng = None,
+                           computeAlong = True,
+                           ):
+    """
+    Vectorized form of computeEncounters for many stream pairs at once.
+    
+    All inputs are broadcast against each other, so a whole network of lane
+    pairs is evaluated in one pass instead of one Python call per pair. The
+    model is identical to computeEncounters; with alongMethod='montecarlo' the
+    samples for the equal-speed pairs are drawn once and shared by all pairs.
+    
+    Parameters
+    ----------
+    rateHourA, rateHourB : array_like
+        Arrival rates of stream A and B [vehicles per hour]
+    speedKmhA, speedKmhB : array_like
+        Speeds of stream A and B [km/h]
+    roadLengthKm : array_like
+        Total road segment length [km]
+    confidenceTreshold : float
+        Minimum confidence threshold for splitting road into analysis pieces
+    groupWindow : float
+        Time window in seconds for group-thinning of arrivals (0 for no thinning)
+    nSamples : int
+        Number of Monte Carlo samples for the equal-speed pairs
+    solver : str
+        'bisection' (default) or 'linear' search for the number of road pieces
+    alongMethod : str
+        'quadrature' (default, deterministic) or 'montecarlo' for equal speeds
+    rng : None, int or numpy.random.Generator
+        Seed or generator for the Monte Carlo samples
+    computeAlong : bool or array_like of bool
+        Pairs for which the along encounters are needed; the along result is 0
+        for the other pairs, which then only pay for the towards encounters
+    
+    Returns
+    -------
+    results : dict
+        Dictionary containing arrays of:
+            - 'Encounters (towards)': expected encounters toward each other per hour
+            - 'Encounters (along)': expected encounters along each other per hour
+    """
+    
+    rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm)))
+    shape = rateHourA.shape
+    rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm = (
+        x.ravel() for x in (rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm))
+    computeAlong = np.broadcast_to(np.asarray(computeAlong, dtype=bool), shape).ravel()
+    speedKmh = np.minimum(speedKmhA, speedKmhB) #slowest moving vehicle decided temporal state
+    
+    #introduce group thinning rates (if groupWindow = 0, no group thinning)
+    rateHourA = rateHourA * np.exp(-(groupWindow/3600)*rateHourA)
+    rateHourB = rateHourB * np.exp(-(groupWindow/3600)*rateHourB)
+    
+    # Smallest number of road pieces for which the state confidence reaches the treshold
+    roadPieces = solveRoadPieces(rateHourA, rateHourB, speedKmh, roadLengthKm, confidenceTreshold, solver)
+    
+    analysisLengthKm = roadLengthKm / roadPieces
+    dwellTimeStateHour = analysisLengthKm / speedKmh
+    # Probability that both lanes hold one vehicle, probGrid[1][1] in the scalar version
+    p11 = (rateHourA*dwellTimeStateHour) * np.exp(-rateHourA*dwellTimeStateHour) * \
+          (rateHourB*dwellTimeStateHour) * np.exp(-rateHourB*dwellTimeStateHour)
+    
+    # Encounters towards for the state space is known deterministacally
+    encProbTowards = 1
+    
+    # Encounters along, only defined for pairs with non-zero rates
+    encProbAlong = np.zeros(rateHourA.shape)
+    rateSum = rateHourA + rateHourB
+    computeAlong = computeAlong & (rateSum > 0)
+    
+    differentSpeed = (speedKmhA != speedKmhB) & computeAlong
+    if differentSpeed.any():
+        idx = np.flatnonzero(differentSpeed)
+        if STATS.enabled:
+            STATS.count('differentSpeedPairs', idx.size)
+        encProbAlong[idx] = alongProbability(rateHourA[idx], rateHourB[idx],
+                                             speedKmhA[idx], speedKmhB[idx], analysisLengthKm[idx])
+    
+    equalSpeed = (speedKmhA == speedKmhB) & computeAlong
+    if equalSpeed.any():
+        idx = np.flatnonzero(equalSpeed)
+        encProbAlong[idx] = expectedAlongProbability(rateHourA[idx], rateHourB[idx],
+                                                     speedKmhA[idx], analysisLengthKm[idx],
+                                                     method=alongMethod, nSamples=nSamples, rng=rng)
+    
+    # Convert to encounter rates for the whole road
+    occurrences = roadPieces * p11
+    encountersTowardsRate = occurrences * encProbTowards / dwellTimeStateHour
+    encountersAlongRate = occurrences * encProbAlong / dwellTimeStateHour
+    
+    results = {
+        'Encounters (towards)': encountersTowardsRate.reshape(shape),
+        'Encounters (along)': encountersAlongRate.reshape(shape),
+        }
+    
+    return results
+
 #------------
 #Example usage
 #-----------
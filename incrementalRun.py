@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Incremental network runs that only recompute changed segments.
+    Every segment gets a 64-bit fingerprint of its inputs (SEGMENT_COLUMNS),
+    the model version (MODEL_VERSION, STD_SPEEDS and the quadrature settings)
+    and the run configuration (confidenceTreshold, groupWindow, alongMethod,
+    nSamples and seed). Results are stored keyed by fingerprint in a .npz
+    result store. A run looks up every fingerprint in the store, computes only
+    the segments that are not found and merges them into the output. Segments
+    with identical inputs share one stored result.
+
+    Fingerprints are computed vectorized (splitmix64 mixing of the input bits),
+    the chance of a collision within a million segments is about 3e-8.
+
+Usage:
+    python incrementalRun.py segments.csv results.csv --store results.npz
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from encountersGenerator import modelSettings
+from networkEncountersGenerator import computeEncountersNetwork, SEGMENT_COLUMNS, RESULT_COLUMNS
+import numpy as np
+
+
+def _mix(values):
+    # splitmix64 finalizer, uint64 arithmetic wraps around
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def runConfiguration(confidenceTreshold=0.84, groupWindow=2, alongMethod='quadrature', nSamples=10_000, seed=None):
+    """
+    Model version and settings that determine the results of a run.
+    """
+    if alongMethod == 'montecarlo' and seed is None:
+        raise ValueError('Incremental Monte Carlo runs need a seed, otherwise results are not reproducible')
+    return {
+        **modelSettings(),
+        'confidenceTreshold': confidenceTreshold,
+        'groupWindow': groupWindow,
+        'alongMethod': alongMethod,
+        # Monte Carlo settings only matter for the Monte Carlo model
+        'nSamples': nSamples if alongMethod == 'montecarlo' else None,
+        'seed': seed if alongMethod == 'montecarlo' else None,
+        }
+
+
+def segmentFingerprints(segments, configuration):
+    """
+    Fingerprint (uint64) of every segment for a run configuration.
+    """
+    configHash = hashlib.sha256(json.dumps(configuration, sort_keys=True).encode()).digest()
+    fingerprints = np.full(np.asarray(segments['length_km']).size,
+                           np.frombuffer(configHash[:8], dtype=np.uint64)[0])
+    for name in SEGMENT_COLUMNS:
+        # + 0.0 turns -0.0 into 0.0, so equal values have equal bits
+        values = np.ascontiguousarray(np.asarray(segments[name], dtype=float).ravel() + 0.0)
+        fingerprints = _mix(fingerprints ^ values.view(np.uint64))
+    return fingerprints
+
+
+class ResultStore:
+    """
+    Segment results keyed by fingerprint, saved as a .npz file.
+
+    Parameters
+    ----------
+    path : str or None
+        .npz file to load the store from (if it exists) and to save it to
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.fingerprints = np.zeros(0, dtype=np.uint64)  # sorted
+        self.results = {name: np.zeros(0) for name in RESULT_COLUMNS}
+        if path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                self.fingerprints = data['fingerprints']
+                self.results = {name: data[name] for name in RESULT_COLUMNS}
+
+    def __len__(self):
+        return self.fingerprints.size
+
+    def lookup(self, fingerprints):
+        """
+        Position in the store of every fingerprint and whether it was found.
+        """
+        position = np.clip(np.searchsorted(self.fingerprints, fingerprints), 0, max(len(self) - 1, 0))
+        found = (self.fingerprints[position] == fingerprints) if len(self) else np.zeros(fingerprints.size, dtype=bool)
+        return position, found
+
+    def merge(self, fingerprints, results, keep=None):
+        """
+        Add results to the store.
+
+        Parameters
+        ----------
+        fingerprints : uint64 array
+        results : dict of arrays
+            RESULT_COLUMNS, one value per fingerprint
+        keep : uint64 array or None
+            If given, stored fingerprints that are not in keep are removed, so
+            the store does not grow with every change of the network
+        """
+        allFingerprints = np.concatenate([self.fingerprints, fingerprints])
+        # new results come last and win from stored results with the same fingerprint
+        total = allFingerprints.size
+        allFingerprints, first = np.unique(allFingerprints[::-1], return_index=True)
+        selected = total - 1 - first
+        if keep is not None:
+            kept = np.isin(allFingerprints, keep)
+            allFingerprints, selected = allFingerprints[kept], selected[kept]
+        self.results = {name: np.concatenate([self.results[name], results[name]])[selected]
+                        for name in RESULT_COLUMNS}
+        self.fingerprints = allFingerprints
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            raise ValueError('No path given to save the result store to')
+        #Write to a temporary file first, so an interrupted save keeps the old store
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, fingerprints=self.fingerprints, **self.results)
+        os.replace(path + '.tmp', path)
+
+
+def runIncremental(segments, store, confidenceTreshold=0.84, groupWindow=2, alongMethod='quadrature',
+                   nSamples=10_000, seed=None, prune=True):
+    """
+    Network results, recomputing only segments without a stored result.
+
+    Parameters
+    ----------
+    segments : dict of arrays
+        Segment attributes (SEGMENT_COLUMNS)
+    store : ResultStore or str
+        Result store, or the path of its .npz file (saved after the run)
+    confidenceTreshold, groupWindow, alongMethod, nSamples :
+        As computeEncountersNetwork
+    seed : int or None
+        Seed of the Monte Carlo model (required for alongMethod='montecarlo')
+    prune : bool
+        Remove stored results of segments that are no longer in the network
+
+    Returns
+    -------
+    results : dict of arrays
+        RESULT_COLUMNS, one value per segment
+    nComputed : int
+        Number of segments that were recomputed
+    """
+    storePath = store if isinstance(store, str) else None
+    if storePath is not None:
+        store = ResultStore(storePath)
+
+    configuration = runConfiguration(confidenceTreshold, groupWindow, alongMethod, nSamples, seed)
+    fingerprints = segmentFingerprints(segments, configuration)
+    _, found = store.lookup(fingerprints)
+
+    #Compute the segments without a result (identical segments once)
+    newFingerprints, newSegments = np.unique(fingerprints[~found], return_index=True)
+    newSegments = np.flatnonzero(~found)[newSegments]
+    if newSegments.size:
+        newResults = computeEncountersNetwork(
+            *(np.asarray(segments[name], dtype=float).ravel()[newSegments] for name in SEGMENT_COLUMNS),
+            confidenceTreshold=confidenceTreshold, groupWindow=groupWindow, alongMethod=alongMethod,
+            nSamples=nSamples, rng=seed)
+        store.merge(newFingerprints, newResults, keep=fingerprints if prune else None)
+    elif prune:
+        store.merge(newFingerprints, {name: np.zeros(0) for name in RESULT_COLUMNS}, keep=fingerprints)
+
+    position, _ = store.lookup(fingerprints)
+    results = {name: store.results[name][position] for name in RESULT_COLUMNS}
+    if storePath is not None:
+        store.save(storePath)
+    return results, int(newSegments.size)
+
+
+def main(argv=None):
+    from segmentTable import readSegmentCsv, writeResultsCsv
+
+    parser = argparse.ArgumentParser(description='Incremental road encounter run for a segment table.')
+    parser.add_argument('input', help='segment table (CSV)')
+    parser.add_argument('output', help='results table (CSV)')
+    parser.add_argument('--store', required=True, help='result store (.npz), created if it does not exist')
+    parser.add_argument('--no-prune', action='store_true', help='keep results of removed segments in the store')
+    args = parser.parse_args(argv)
+
+    startTime = time.time()
+    segments = readSegmentCsv(args.input)
+    results, nComputed = runIncremental(segments, args.store, prune=not args.no_prune)
+    writeResultsCsv(args.output, segments, results)
+    nSegments = len(results[RESULT_COLUMNS[0]])
+    print(f'{nComputed} of {nSegments} segments recomputed in {time.time() - startTime:.1f} s')
+
+
+if __name__ == "__main__":
+    main()
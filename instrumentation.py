@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Opt-in instrumentation of the encounter engine.
+    When enabled, the engine counts solver iterations, Monte Carlo and
+    quadrature evaluations, cache hits and skipped lane pairs, and times its
+    stages (roadPieces search, along probability, matrix building, pair
+    assembly and classification). When disabled (the default) every hook is a
+    single attribute check.
+
+Usage:
+    import instrumentation
+    instrumentation.enable()
+    ... run the model ...
+    print(instrumentation.getStats())
+    instrumentation.exportStats('stats.json')
+"""
+
+from contextlib import contextmanager, nullcontext
+import json
+import time
+
+
+class EngineStats:
+    """
+    Counters and per-stage timers of the encounter engine.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = {}
+        self.timers = {}
+        self.calls = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def _timer(self, name):
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - startTime
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def timer(self, name):
+        """
+        Context manager that adds its duration to the timer of a stage.
+        """
+        return self._timer(name) if self.enabled else _NO_TIMER
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+        self.calls.clear()
+
+    def snapshot(self):
+        """
+        Copy of the statistics as a plain dict.
+        """
+        return {
+            'counters': dict(self.counters),
+            'timers': {name: {'seconds': seconds, 'calls': self.calls[name]}
+                       for name, seconds in self.timers.items()},
+            }
+
+
+_NO_TIMER = nullcontext()
+
+# Statistics of this process, used by all engine modules
+STATS = EngineStats()
+
+
+def enable(reset=True):
+    if reset:
+        STATS.reset()
+    STATS.enabled = True
+
+
+def disable():
+    STATS.enabled = False
+
+
+def getStats():
+    return STATS.snapshot()
+
+
+def exportStats(path):
+    """
+    Write the statistics to a JSON file.
+    """
+    with open(path, 'w') as f:
+        json.dump(STATS.snapshot(), f, indent=2)
+
+
+def profileRun(func, *args, outputPath=None, sortBy='cumulative', nLines=25, **kwargs):
+    """
+    Run func(*args, **kwargs) under cProfile, with instrumentation enabled.
+
+    Prints the top nLines functions and, if outputPath is given, writes the
+    profile (pstats format) to outputPath and the engine statistics to
+    outputPath + '.json'.
+
+    Returns
+    -------
+    result : return value of func
+    """
+    import cProfile
+    import pstats
+
+    wasEnabled = STATS.enabled
+    enable()
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        STATS.enabled = wasEnabled
+    pstats.Stats(profiler).sort_stats(sortBy).print_stats(nLines)
+    if outputPath is not None:
+        profiler.dump_stats(outputPath)
+        exportStats(outputPath + '.json')
+    return result
@@ -4,6 +4,21 @@
 """
 
 import numpy as np
+from collections import namedtuple
+from functools import lru_cache
+from instrumentation import STATS
+
+# Lane sources, in the lane order used by generateInteractionMatrices
+LANE_FIETS_T = 0
+LANE_AUTO_T = 1
+LANE_AUTO_H = 2
+LANE_FIETS_H = 3
+
+# Encounter categories of a lane pair, indexed by the number of cycling lanes in the pair
+CATEGORY_CC = 0  # car-car
+CATEGORY_BC = 1  # bike-car
+CATEGORY_BB = 2  # bike-bike
+ENCOUNTER_CATEGORIES = ('cc', 'bc', 'bb')
 
 def generateInteractionMatrices(aantal_rijstroken_heen: int,
                                 aantal_rijstroken_terug: int,
@@ -39,12 +54,9 @@ def generateInteractionMatrices(aantal_rijstroken_heen: int,
     # Determine the index separating directions
     edgeIndex = fiets_t_allowed + (aantal_rijstroken_terug* auto_t_allowed) - 1  # last lane of terug direction
           
-    # Build along matrix
-    for a in range(nLanes):
-        interactionAlong[a, a] = 1  # self-interaction always for along
-        for b in range(nLanes):
-            if abs(a - b) == 1:  # lanes next to each other 
-                interactionAlong[a, b] = 1 #these interact 
+    # Build along matrix: self-interaction and lanes next to each other interact
+    lanes = np.arange(nLanes)
+    interactionAlong[np.abs(lanes[:, None] - lanes[None, :]) <= 1] = 1
                 
     # Remove interactions for along between opposing car lanes if opposing traffic exists
     if boolAutoTerug == 1 and boolAutoHeen == 1: #when there is both to and from car traffic
@@ -72,6 +84,117 @@ def generateInteractionMatrices(aantal_rijstroken_heen: int,
            
     return interactionAlong, interactionToward
 
+def interactingPairs(interactionAlong, interactionToward):
+    """
+    Sparse list of the interacting lane pairs of a road segment.
+    
+    Only the upper triangle is used (laneA <= laneB), in the same order as the
+    lane pair loop of computeEncountersRoad.
+    
+    Parameters:
+    interactionAlong : NxN matrix of lane interactions along the lane
+    interactionToward : NxN matrix of lane interactions toward opposing lanes
+    
+    Returns:
+    laneA, laneB : lane indices of every pair that interacts along and/or toward
+    isAlong : bool per pair, True if the pair interacts along the lane
+    isToward : bool per pair, True if the pair interacts toward each other
+    """
+    interactionAlong = np.triu(interactionAlong)
+    interactionToward = np.triu(interactionToward)
+    laneA, laneB = np.nonzero(interactionAlong + interactionToward)
+    isAlong = interactionAlong[laneA, laneB] != 0
+    isToward = interactionToward[laneA, laneB] != 0
+    return laneA, laneB, isAlong, isToward
+
+def laneSources(aantal_rijstroken_heen, aantal_rijstroken_terug,
+                fiets_h_allowed, fiets_t_allowed, auto_h_allowed, auto_t_allowed):
+    """
+    Source of every lane of a layout (LANE_FIETS_T, LANE_AUTO_T, LANE_AUTO_H or LANE_FIETS_H).
+    """
+    sources = [LANE_FIETS_T] * fiets_t_allowed
+    sources += [LANE_AUTO_T] * (aantal_rijstroken_terug * auto_t_allowed)
+    sources += [LANE_AUTO_H] * (aantal_rijstroken_heen * auto_h_allowed)
+    sources += [LANE_FIETS_H] * fiets_h_allowed
+    return np.array(sources, dtype=np.int64)
+
+
+# Everything the encounter computation needs to know about a lane layout
+LayoutTemplate = namedtuple('LayoutTemplate', [
+    'interactionAlong',  # NxN along interaction matrix
+    'interactionToward',  # NxN toward interaction matrix
+    'laneSources',  # LANE_ source of every lane
+    'laneIsBike',  # True for cycling lanes
+    'laneA',  # first lane of every interacting pair (upper triangle)
+    'laneB',  # second lane of every interacting pair
+    'isAlong',  # pair interacts along the lane
+    'isToward',  # pair interacts toward each other
+    'pairCategory',  # CATEGORY_ of every interacting pair
+    'categoryMasks',  # 3xNxN bool, upper triangle lane pairs of every CATEGORY_
+    ])
+
+
+def layoutKey(aantal_rijstroken_heen, aantal_rijstroken_terug,
+              fiets_h_allowed, fiets_t_allowed, auto_h_allowed, auto_t_allowed):
+    """
+    Canonical key of a lane layout: (car lanes heen, car lanes terug, fiets_h_allowed, fiets_t_allowed).
+    
+    Car lanes that are not allowed do not exist, so layouts with the same key
+    have the same lanes and interaction matrices. Works on scalars and arrays.
+    """
+    return (aantal_rijstroken_heen * auto_h_allowed, aantal_rijstroken_terug * auto_t_allowed,
+            fiets_h_allowed, fiets_t_allowed)
+
+
+@lru_cache(maxsize=None)
+def _layoutTemplate(lanesHeen, lanesTerug, fiets_h_allowed, fiets_t_allowed):
+    if STATS.enabled:
+        STATS.count('layoutTemplatesBuilt')
+    with STATS.timer('matrixBuilding'):
+        interactionAlong, interactionToward = generateInteractionMatrices(
+            lanesHeen, lanesTerug, fiets_h_allowed, fiets_t_allowed, 1, 1)
+    sources = laneSources(lanesHeen, lanesTerug, fiets_h_allowed, fiets_t_allowed, 1, 1)
+    laneIsBike = (sources == LANE_FIETS_T) | (sources == LANE_FIETS_H)
+    laneA, laneB, isAlong, isToward = interactingPairs(interactionAlong, interactionToward)
+    # The number of cycling lanes in a pair is its category
+    laneCategory = laneIsBike[:, None].astype(np.int64) + laneIsBike[None, :]
+    upper = np.triu(np.ones_like(laneCategory, dtype=bool))
+    template = LayoutTemplate(
+        interactionAlong,
+        interactionToward,
+        sources,
+        laneIsBike,
+        laneA,
+        laneB,
+        isAlong,
+        isToward,
+        laneCategory[laneA, laneB],
+        np.stack([upper & (laneCategory == c) for c in range(len(ENCOUNTER_CATEGORIES))]),
+        )
+    # Templates are shared between all roads with this layout
+    for array in template:
+        array.flags.writeable = False
+    return template
+
+
+def getLayoutTemplate(aantal_rijstroken_heen: int,
+                      aantal_rijstroken_terug: int,
+                      fiets_h_allowed: int,
+                      fiets_t_allowed: int,
+                      auto_h_allowed: int,
+                      auto_t_allowed: int):
+    """
+    Precomputed, read-only LayoutTemplate of a lane layout.
+    
+    Templates are built once per distinct layout (see layoutKey) and shared, so
+    batch runs can group road segments by layout and reuse one template.
+    
+    Parameters are the same as generateInteractionMatrices.
+    """
+    return _layoutTemplate(*(int(v) for v in layoutKey(
+        aantal_rijstroken_heen, aantal_rijstroken_terug,
+        fiets_h_allowed, fiets_t_allowed, auto_h_allowed, auto_t_allowed)))
+
 # -----------------------
 # Example usage
 # -----------------------
@@ -88,6 +211,7 @@ if __name__ == "__main__":
 
     print("Interaction Along Matrix:\n", interactionAlong)
     print("\nInteraction Toward Matrix:\n", interactionToward)
+    print("\nInteracting lane pairs:\n", interactingPairs(interactionAlong, interactionToward))
             
     
 
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Batch version of computeEncountersRoad for whole road networks.
+    Segment attributes are passed as columns (one value per road segment) and
+    the interacting lane pairs of all segments are evaluated in a single
+    vectorized call to computeEncountersArray. Segments are grouped by lane layout so that the
+    interaction matrices are generated once per distinct layout only.
+
+    Parameters are the same as computeEncountersRoad, but as arrays. The model
+    settings (confidenceTreshold, groupWindow) and the equal-speed options
+    (alongMethod, nSamples, rng) are passed on to computeEncountersArray.
+    An optional encounterCache.EncounterCache reuses lane pair results within
+    and across calls (quadrature model only). With an encounterTable.EncounterTable
+    the lane pairs are interpolated from the table instead, and the results
+    also contain 'totalErrorBoundHour', the summed error bound of the pairs.
+    With deduplicate=True identical lane pairs are computed once, which pays
+    off when many segments share inputs (parameter sweeps).
+    For very large networks, roadNetwork.RoadNetwork keeps the segments in
+    compact typed arrays and computes them in chunks of bounded memory.
+
+Returns:
+    results : dict of arrays
+        'totalEncountersHour', 'ccEncountersHour', 'bcEncountersHour' and
+        'bbEncountersHour' and their along/towards split (CATEGORY_RESULT_COLUMNS),
+        one value per road segment
+"""
+
+from collections import namedtuple
+from encountersGenerator import computeEncountersArray
+from instrumentation import STATS
+from interactionGenerator import getLayoutTemplate, layoutKey, ENCOUNTER_CATEGORIES
+import numpy as np
+
+# Column names of a road segment table, in the argument order of computeEncountersRoad
+SEGMENT_COLUMNS = (
+    'aantal_rijstroken_heen',
+    'aantal_rijstroken_terug',
+    'intensiteit_heen_pae_per_dag',
+    'intensiteit_terug_pae_per_dag',
+    'snelheid_heen_km_per_uur',
+    'snelheid_terug_km_per_uur',
+    'fiets_h',
+    'fiets_t',
+    'fietsSpeedKmh',
+    'length_km',
+    )
+
+# Two-lane urban road with cycle lanes, used in the examples
+EXAMPLE_ROAD = dict(
+    aantal_rijstroken_heen=1,
+    aantal_rijstroken_terug=1,
+    intensiteit_heen_pae_per_dag=8000,
+    intensiteit_terug_pae_per_dag=7500,
+    snelheid_heen_km_per_uur=50,
+    snelheid_terug_km_per_uur=50,
+    fiets_h=1500,
+    fiets_t=1500,
+    fietsSpeedKmh=18,
+    length_km=0.8,
+    )
+
+def segmentColumns(road):
+    """
+    Road attributes as flat float columns, one value per segment.
+
+    Parameters
+    ----------
+    road : dict
+        Road attributes (SEGMENT_COLUMNS), scalars for one road or arrays for
+        the segments of a corridor or network (broadcast to a common shape)
+
+    Returns
+    -------
+    columns : dict of 1d float arrays
+        SEGMENT_COLUMNS, one value per segment
+    isArray : bool
+        True if the road was given as arrays, False for a single road
+    """
+    columns = np.broadcast_arrays(*(np.asarray(road[name], dtype=float) for name in SEGMENT_COLUMNS))
+    isArray = columns[0].ndim > 0
+    return {name: np.atleast_1d(column).ravel() for name, column in zip(SEGMENT_COLUMNS, columns)}, isArray
+
+# Result names of computeEncountersRoad and computeEncountersNetwork
+RESULT_COLUMNS = (
+    'totalEncountersHour',
+    'ccEncountersHour',
+    'bcEncountersHour',
+    'bbEncountersHour',
+    )
+
+# Along/towards split of the encounter types, e.g. 'ccAlongEncountersHour'
+CATEGORY_RESULT_COLUMNS = tuple(f'{category}{direction}EncountersHour'
+                                for category in ENCOUNTER_CATEGORIES
+                                for direction in ('Along', 'Towards'))
+
+# Interacting lane pairs of a batch of segments, one value per pair
+LanePairs = namedtuple('LanePairs', [
+    'segment',  # segment of the pair, index into the batch
+    'laneA',  # first lane, index within the lanes of the segment
+    'laneB',  # second lane
+    'sourceA',  # LANE_ source of the first lane
+    'sourceB',  # LANE_ source of the second lane
+    'isAlong',  # the lanes drive in the same direction
+    'isToward',  # the lanes drive in opposite directions
+    'category',  # CATEGORY_ of the pair
+    ])
+
+def laneInputs(segments):
+    """
+    Lane layout and per-lane rate and speed of every lane source of a batch
+    of segments, allowed flags as in computeEncountersRoad.
+
+    Parameters
+    ----------
+    segments : dict of arrays
+        Segment attributes (SEGMENT_COLUMNS), one value per segment
+
+    Returns
+    -------
+    layouts : (nSegments, 4) int64 array
+        Layout of every segment (see interactionGenerator.layoutKey)
+    sourceRates, sourceSpeeds : (nSegments, 4) float arrays
+        Rate per lane [vehicles per hour] and speed [km/h] of every lane
+        source, columns ordered as the LANE_ constants
+    """
+    s = segments
+    layouts = np.stack(layoutKey(
+        np.asarray(s['aantal_rijstroken_heen']).astype(np.int64),
+        np.asarray(s['aantal_rijstroken_terug']).astype(np.int64),
+        (s['fiets_h'] != 0).astype(np.int64),
+        (s['fiets_t'] != 0).astype(np.int64),
+        (s['intensiteit_heen_pae_per_dag'] != 0).astype(np.int64),
+        (s['intensiteit_terug_pae_per_dag'] != 0).astype(np.int64),
+        ), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sourceRates = np.stack([
+            s['fiets_t'] / 24,
+            s['intensiteit_terug_pae_per_dag'] / 24 / s['aantal_rijstroken_terug'],
+            s['intensiteit_heen_pae_per_dag'] / 24 / s['aantal_rijstroken_heen'],
+            s['fiets_h'] / 24,
+            ], axis=1)
+    sourceSpeeds = np.stack([s['fietsSpeedKmh'], s['snelheid_terug_km_per_uur'],
+                             s['snelheid_heen_km_per_uur'], s['fietsSpeedKmh']], axis=1)
+    return layouts, sourceRates, sourceSpeeds
+
+def assemblePairs(layouts, layoutIndex):
+    """
+    All interacting lane pairs of a batch of segments, one layout at a time.
+    Only pairs of the upper triangle are returned, so that encounters are not
+    double counted.
+
+    Parameters
+    ----------
+    layouts : (nLayouts, 4) array
+        Distinct lane layouts (see interactionGenerator.layoutKey)
+    layoutIndex : int array
+        Layout of every segment of the batch, index into layouts
+
+    Returns
+    -------
+    pairs : LanePairs
+    """
+    pairs = LanePairs(*([] for _ in LanePairs._fields))
+    with STATS.timer('pairAssembly'):
+        for k in np.unique(layoutIndex):
+            segments = np.flatnonzero(layoutIndex == k)
+            template = getLayoutTemplate(*(int(v) for v in layouts[k]), 1, 1)
+            laneA, laneB = template.laneA, template.laneB
+            nPairs = laneA.size
+            if STATS.enabled:
+                nLanes = template.laneSources.size
+                STATS.count('pairsEvaluated', nPairs * segments.size)
+                STATS.count('pairsSkipped', (nLanes * (nLanes + 1) // 2 - nPairs) * segments.size)
+
+            pairs.segment.append(np.repeat(segments, nPairs))
+            pairs.laneA.append(np.tile(laneA, segments.size))
+            pairs.laneB.append(np.tile(laneB, segments.size))
+            pairs.sourceA.append(np.tile(template.laneSources[laneA], segments.size))
+            pairs.sourceB.append(np.tile(template.laneSources[laneB], segments.size))
+            pairs.isAlong.append(np.tile(template.isAlong, segments.size))
+            pairs.isToward.append(np.tile(template.isToward, segments.size))
+            pairs.category.append(np.tile(template.pairCategory, segments.size))
+
+        #No segments: empty pair arrays
+        if not pairs.segment:
+            return LanePairs(*(np.zeros(0, dtype=np.int64) for _ in LanePairs._fields))
+        return LanePairs(*(np.concatenate(values) for values in pairs))
+
+def classifyPairs(pairs, enc, nSegments, errorBound=False):
+    """
+    Sum the lane pair encounters per segment, per encounter type and along/towards.
+
+    Parameters
+    ----------
+    pairs : LanePairs
+    enc : dict of arrays
+        As computeEncountersArray, one value per lane pair
+    nSegments : int
+        Number of segments of the batch
+    errorBound : bool
+        Also sum the error bounds of a table ('totalErrorBoundHour')
+
+    Returns
+    -------
+    results : dict of float64 arrays
+        RESULT_COLUMNS and CATEGORY_RESULT_COLUMNS, one value per segment
+    """
+    with STATS.timer('classification'):
+        pairIndex = pairs.segment * 3 + pairs.category
+        along = np.bincount(pairIndex, weights=np.asarray(enc['Encounters (along)'], dtype=float),
+                            minlength=nSegments * 3).reshape(nSegments, 3)
+        towards = np.bincount(pairIndex, weights=np.asarray(enc['Encounters (towards)'] * pairs.isToward, dtype=float),
+                              minlength=nSegments * 3).reshape(nSegments, 3)
+        byType = along + towards
+
+        results = {
+            'totalEncountersHour': byType.sum(axis=1),
+            'ccEncountersHour': byType[:, 0],
+            'bcEncountersHour': byType[:, 1],
+            'bbEncountersHour': byType[:, 2]}
+        for c, category in enumerate(ENCOUNTER_CATEGORIES):
+            results[f'{category}AlongEncountersHour'] = along[:, c]
+            results[f'{category}TowardsEncountersHour'] = towards[:, c]
+        if errorBound:
+            pairErrorBound = enc['Error bound (along)'] + enc['Error bound (towards)'] * pairs.isToward
+            results['totalErrorBoundHour'] = np.bincount(pairs.segment, weights=np.asarray(pairErrorBound, dtype=float),
+                                                         minlength=nSegments)
+    return results
+
+def evaluatePairs(rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm, computeAlong,
+                  confidenceTreshold=0.84, groupWindow=2, alongMethod='quadrature', nSamples=10_000,
+                  rng=None, cache=None, table=None, deduplicate=False):
+    """
+    Encounters of a flat list of lane pairs, with the model, cache or table
+    options of computeEncountersNetwork.
+
+    Returns
+    -------
+    enc : dict of arrays
+        As computeEncountersArray, one value per lane pair
+    """
+    pairInputs = (rateHourA, rateHourB, speedKmhA, speedKmhB, roadLengthKm)
+    pairCompute = computeAlong
+    if deduplicate:
+        uniqueInputs, pairInverse = np.unique(np.stack(pairInputs + (computeAlong,), axis=1),
+                                              axis=0, return_inverse=True)
+        pairInverse = pairInverse.ravel()
+        pairInputs, pairCompute = tuple(uniqueInputs[:, :5].T), uniqueInputs[:, 5] > 0
+        if STATS.enabled:
+            STATS.count('pairsDeduplicated', computeAlong.size - pairCompute.size)
+    pairInputs = pairInputs + (confidenceTreshold, groupWindow)
+    if cache is not None or table is not None:
+        if alongMethod != 'quadrature':
+            raise ValueError("The encounter cache and table only support alongMethod='quadrature'")
+        if cache is not None and table is not None:
+            raise ValueError('Use either an encounter cache or an encounter table')
+        with STATS.timer('pairEvaluation'):
+            enc = (table or cache).computeEncountersArray(*pairInputs, computeAlong=pairCompute)
+    else:
+        with STATS.timer('pairEvaluation'):
+            enc = computeEncountersArray(*pairInputs, nSamples=nSamples, alongMethod=alongMethod,
+                                         rng=rng, computeAlong=pairCompute)
+    if deduplicate:
+        enc = {key: value[pairInverse] for key, value in enc.items()}
+    return enc
+
+def computeEncountersNetwork(
+    aantal_rijstroken_heen,
+    aantal_rijstroken_terug,
+    intensiteit_heen_pae_per_dag,
+    intensiteit_terug_pae_per_dag,
+    snelheid_heen_km_per_uur,
+    snelheid_terug_km_per_uur,
+    fiets_h,
+    fiets_t,
+    fietsSpeedKmh,
+    length_km,
+    confidenceTreshold=0.84,
+    groupWindow=2,
+    alongMethod='quadrature',
+    nSamples=10_000,
+    rng=None,
+    cache=None,
+    table=None,
+    deduplicate=False,
+):
+    segments, _ = segmentColumns(dict(zip(SEGMENT_COLUMNS, (
+        aantal_rijstroken_heen, aantal_rijstroken_terug,
+        intensiteit_heen_pae_per_dag, intensiteit_terug_pae_per_dag,
+        snelheid_heen_km_per_uur, snelheid_terug_km_per_uur,
+        fiets_h, fiets_t, fietsSpeedKmh, length_km))))
+    nSegments = segments['length_km'].size
+
+    layouts, sourceRates, sourceSpeeds = laneInputs(segments)
+    uniqueLayouts, layoutIndex = np.unique(layouts, axis=0, return_inverse=True)
+    pairs = assemblePairs(uniqueLayouts, layoutIndex.ravel())
+
+    #No lanes that interact (or no segments at all): no encounters
+    if pairs.segment.size == 0:
+        results = {name: np.zeros(nSegments) for name in RESULT_COLUMNS + CATEGORY_RESULT_COLUMNS}
+        if table is not None:
+            results['totalErrorBoundHour'] = np.zeros(nSegments)
+        return results
+
+    #Evaluate all (distinct) lane pairs in one pass
+    enc = evaluatePairs(sourceRates[pairs.segment, pairs.sourceA], sourceRates[pairs.segment, pairs.sourceB],
+                        sourceSpeeds[pairs.segment, pairs.sourceA], sourceSpeeds[pairs.segment, pairs.sourceB],
+                        segments['length_km'][pairs.segment], pairs.isAlong, confidenceTreshold, groupWindow,
+                        alongMethod, nSamples, rng, cache, table, deduplicate)
+    return classifyPairs(pairs, enc, nSegments, errorBound=table is not None)
+
+#----------------
+#Example usage
+#---------------
+
+if __name__ == "__main__":
+    import time
+
+    # Synthetic network of urban and rural road segments
+    nSegments = 10_000
+    rng = np.random.default_rng(0)
+    lanes = rng.integers(0, 3, nSegments)
+
+    startTime = time.time()
+    results = computeEncountersNetwork(
+        aantal_rijstroken_heen=lanes,
+        aantal_rijstroken_terug=lanes,
+        intensiteit_heen_pae_per_dag=rng.uniform(0, 10_000, nSegments) * (lanes > 0),
+        intensiteit_terug_pae_per_dag=rng.uniform(0, 10_000, nSegments) * (lanes > 0),
+        snelheid_heen_km_per_uur=rng.choice([30, 50, 80], nSegments),
+        snelheid_terug_km_per_uur=rng.choice([30, 50, 80], nSegments),
+        fiets_h=rng.choice([0, 500], nSegments),
+        fiets_t=rng.choice([0, 500], nSegments),
+        fietsSpeedKmh=18,
+        length_km=rng.uniform(0.05, 2, nSegments),
+        )
+    elapsedTime = time.time() - startTime
+    print(f'{nSegments} segments took {elapsedTime:.2f} s')
+    print('Total encounters per hour:', results['totalEncountersHour'].sum())
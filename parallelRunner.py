@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Run computeEncountersNetwork over a large segment table on all cores.
+    The table is split into chunks of segments which are evaluated in a
+    process pool. Results are put back in input order, so the output does not
+    depend on the number of workers. Every chunk gets its own RNG stream,
+    spawned from one seed, for the stochastic (Monte Carlo) path.
+
+Usage:
+    python parallelRunner.py segments.csv results.csv --workers 8 --chunk-size 10000
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import sys
+import time
+from networkEncountersGenerator import computeEncountersNetwork, SEGMENT_COLUMNS, RESULT_COLUMNS
+from segmentTable import readSegmentCsv, writeResultsCsv
+import numpy as np
+
+
+def _computeChunk(columns, settings, seedSequence):
+    """
+    Work unit of a worker process: one chunk of segments.
+    """
+    rng = np.random.default_rng(seedSequence)
+    return computeEncountersNetwork(*columns, rng=rng, **settings)
+
+
+def computeEncountersParallel(segments, maxWorkers=None, chunkSize=10_000, seed=None,
+                              progress=None, **settings):
+    """
+    Compute encounters for a segment table with a process pool.
+
+    Parameters
+    ----------
+    segments : dict of arrays
+        Segment table with (at least) the SEGMENT_COLUMNS
+    maxWorkers : int or None
+        Number of worker processes (None for the number of cores)
+    chunkSize : int
+        Number of segments per work unit
+    seed : None, int or numpy.random.SeedSequence
+        Seed of the RNG streams of the chunks
+    progress : callable or None
+        Called as progress(doneSegments, totalSegments) after every chunk
+    **settings
+        Passed on to computeEncountersNetwork (confidenceTreshold, groupWindow,
+        alongMethod, nSamples)
+
+    Returns
+    -------
+    results : dict of arrays
+        RESULT_COLUMNS, one value per segment in input order
+    """
+    columns = [np.asarray(segments[c], dtype=float) for c in SEGMENT_COLUMNS]
+    nSegments = len(columns[-1])
+    starts = range(0, nSegments, chunkSize)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seedSequences = seed.spawn(len(starts))
+
+    results = {name: np.empty(nSegments) for name in RESULT_COLUMNS}
+    done = 0
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = {}
+        for start, seedSequence in zip(starts, seedSequences):
+            chunk = [c[start:start+chunkSize] for c in columns]
+            futures[executor.submit(_computeChunk, chunk, settings, seedSequence)] = start
+        for future in as_completed(futures):
+            start = futures[future]
+            chunkResults = future.result()
+            for name in RESULT_COLUMNS:
+                results[name][start:start+len(chunkResults[name])] = chunkResults[name]
+            done += len(chunkResults[RESULT_COLUMNS[0]])
+            if progress is not None:
+                progress(done, nSegments)
+    return results
+
+
+def progressPrinter(startTime=None):
+    """
+    Progress callback that reports segments done, percentage and throughput on stderr.
+    """
+    startTime = time.time() if startTime is None else startTime
+
+    def printProgress(done, total):
+        elapsed = max(time.time() - startTime, 1e-9)
+        print(f'\r{done}/{total} segments ({100*done/max(total, 1):.0f}%), '
+              f'{done/elapsed:.0f} segments/s', end='\n' if done == total else '', file=sys.stderr)
+    return printProgress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute road user encounters for a segment table on all cores.')
+    parser.add_argument('segments', help='input CSV with one row per road segment')
+    parser.add_argument('output', help='output CSV with the segments and their encounters per hour')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=10_000, help='segments per work unit')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the RNG streams (Monte Carlo only)')
+    parser.add_argument('--along-method', choices=['quadrature', 'montecarlo'], default='quadrature')
+    parser.add_argument('--samples', type=int, default=10_000, help='Monte Carlo samples per lane pair')
+    parser.add_argument('--confidence', type=float, default=0.84, help='confidence treshold of the road pieces')
+    parser.add_argument('--group-window', type=float, default=2, help='group thinning window [s]')
+    parser.add_argument('--quiet', action='store_true', help='do not report progress')
+    args = parser.parse_args(argv)
+
+    segments = readSegmentCsv(args.segments)
+    startTime = time.time()
+    results = computeEncountersParallel(
+        segments, maxWorkers=args.workers, chunkSize=args.chunk_size, seed=args.seed,
+        progress=None if args.quiet else progressPrinter(startTime),
+        confidenceTreshold=args.confidence, groupWindow=args.group_window,
+        alongMethod=args.along_method, nSamples=args.samples)
+    writeResultsCsv(args.output, segments, results)
+    if not args.quiet:
+        print(f'Done in {time.time() - startTime:.1f} s', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Time-of-day mode of the road encounter model.
+    Instead of a flat hourly rate (daily intensity / 24), the intensities of
+    the car and cycling directions follow a profile of nBins time bins per day
+    (24 for hourly bins, 96 for quarters). Every segment is evaluated for every
+    time bin in one computeEncountersNetwork batch: a bin with count c of
+    a 24/nBins hour duration has the hourly rate of a daily intensity of
+    c * nBins. With deduplicate=True, bins that share inputs (e.g. a standard
+    profile on many similar segments) are computed once.
+
+Returns:
+    ProfileResult, with the start hour of every bin, the encounters per hour
+    in every bin (the curve) and the daily totals (sum over the bins).
+"""
+
+from collections import namedtuple
+from networkEncountersGenerator import computeEncountersNetwork, segmentColumns, SEGMENT_COLUMNS
+import numpy as np
+
+# Columns of computeEncountersRoad that can follow a time-of-day profile
+PROFILE_COLUMNS = (
+    'intensiteit_heen_pae_per_dag',
+    'intensiteit_terug_pae_per_dag',
+    'fiets_h',
+    'fiets_t',
+    )
+
+ProfileResult = namedtuple('ProfileResult', [
+    'binStartHours',  # start of every time bin [hour of the day]
+    'perBin',  # dict of result name -> encounters per hour in every bin (last axis)
+    'daily',  # dict of result name ('...EncountersDay') -> encounters per day
+    ])
+
+
+def computeEncountersProfile(road, profiles, relative=False, deduplicate=False, **settings):
+    """
+    Encounters of a road or network per time bin of the day.
+
+    Parameters
+    ----------
+    road : dict
+        Road attributes (SEGMENT_COLUMNS), scalars for one road or arrays for
+        the segments of a network
+    profiles : dict
+        PROFILE_COLUMNS name -> profile of nBins values, or (nSegments, nBins)
+        for a profile per segment. Columns without a profile are spread evenly
+        over the day.
+    relative : bool
+        If False, the profiles are the counts per bin. If True, they are
+        weights that distribute the daily intensity of the road over the bins
+        (normalized to sum to 1), e.g. a standard hourly traffic pattern
+    deduplicate : bool
+        Compute identical lane pairs once, see computeEncountersNetwork
+    **settings
+        Passed on to computeEncountersNetwork
+
+    Returns
+    -------
+    result : ProfileResult
+    """
+    unknown = [name for name in profiles if name not in PROFILE_COLUMNS]
+    if unknown:
+        raise ValueError(f'No time-of-day profile possible for {unknown}, use one of {PROFILE_COLUMNS}')
+    if not profiles:
+        raise ValueError('Give the profile of at least one of the intensity columns')
+
+    base, isNetwork = segmentColumns(road)
+    nSegments = base[SEGMENT_COLUMNS[0]].size
+
+    profiles = {name: np.asarray(profile, dtype=float) for name, profile in profiles.items()}
+    nBins = {profile.shape[-1] for profile in profiles.values()}
+    if len(nBins) != 1:
+        raise ValueError('All profiles must have the same number of time bins')
+    nBins = nBins.pop()
+
+    #Daily-equivalent intensity of every segment in every bin
+    columns = {}
+    for name in SEGMENT_COLUMNS:
+        column = np.broadcast_to(base[name][:, None], (nSegments, nBins))
+        if name in profiles:
+            profile = np.broadcast_to(profiles[name], (nSegments, nBins))
+            if relative:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    shares = np.nan_to_num(profile / profile.sum(axis=1, keepdims=True))
+                column = column * shares * nBins
+            else:
+                column = profile * nBins
+        columns[name] = column.ravel()
+
+    results = computeEncountersNetwork(**columns, deduplicate=deduplicate, **settings)
+    outShape = (nSegments, nBins) if isNetwork else (nBins,)
+    perBin = {name: value.reshape(outShape) for name, value in results.items()}
+    binHours = 24 / nBins
+    daily = {name.replace('Hour', 'Day'): value.sum(axis=-1) * binHours for name, value in perBin.items()}
+    return ProfileResult(np.arange(nBins) * binHours, perBin, daily)
+
+#----------------
+#Example usage
+#---------------
+
+if __name__ == "__main__":
+    from networkEncountersGenerator import EXAMPLE_ROAD
+
+    # Hourly weights with a morning and an evening peak
+    hours = np.arange(24)
+    weekday = 0.2 + np.exp(-0.5 * ((hours - 8) / 1.5)**2) + np.exp(-0.5 * ((hours - 17) / 1.5)**2)
+    profile = computeEncountersProfile(EXAMPLE_ROAD, {name: weekday for name in PROFILE_COLUMNS}, relative=True)
+    for hour, encounters in zip(profile.binStartHours, profile.perBin['totalEncountersHour']):
+        print(f'{hour:5.1f} h {encounters:10.1f} encounters per hour')
+    print('Encounters per day:', profile.daily['totalEncountersDay'])
@@ -38,15 +38,21 @@ Function purpose:
         Average cyclist speed (km/h)
     length_km : float
         Length of the road segment in kilometers
+    cache : encounterCache.EncounterCache, optional
+        Cache of lane pair results, reused within and across roads
 
 Returns:
-    encounters : float
-        Total number of encounters between all lanes and road users
+    results : dict
+        'totalEncountersHour', the total number of encounters between all lanes
+        and road users, and per encounter type (cc = car-car, bc = bike-car,
+        bb = bike-bike) '<type>EncountersHour' with its split into
+        '<type>AlongEncountersHour' and '<type>TowardsEncountersHour'
 """
 
 
-from encountersGenerator import computeEncounters
-from interactionGenerator import generateInteractionMatrices
+from encountersGenerator import computeEncountersArray
+from instrumentation import STATS
+from interactionGenerator import getLayoutTemplate, ENCOUNTER_CATEGORIES
 import numpy as np
 def computeEncountersRoad(
     aantal_rijstroken_heen,
@@ -58,7 +64,8 @@ def computeEncountersRoad(
     fiets_h,
     fiets_t,
     fietsSpeedKmh,
-    length_km
+    length_km,
+    cache=None
 ):
     
     auto_h_allowed = 0 if not intensiteit_heen_pae_per_dag else 1
@@ -66,14 +73,15 @@ def computeEncountersRoad(
     fiets_h_allowed =  0 if not fiets_h else 1
     fiets_t_allowed = 0 if not fiets_t else 1
     
-    #Generate interaction matrices
-    interactionAlong, interactionTowards = generateInteractionMatrices(
+    #Precomputed interaction matrices and interacting lane pairs of this lane layout
+    template = getLayoutTemplate(
         aantal_rijstroken_heen, aantal_rijstroken_terug, 
         fiets_h_allowed, 
         fiets_t_allowed, 
         auto_h_allowed, 
         auto_t_allowed
     )
+    interactionAlong, interactionTowards = template.interactionAlong, template.interactionToward
     
     #Check if interaction matrices are same size
     assert len(interactionAlong) == len(interactionTowards)
@@ -81,7 +89,7 @@ def computeEncountersRoad(
 
     #Initialize encounter matrices
     encountersTowards = np.zeros((nLanes,nLanes))
-    encountersAlong = encountersTowards
+    encountersAlong = np.zeros((nLanes,nLanes))
     #Iniatialize rates and speeds lists
     ratesHour = []
     speedsKmh = []
@@ -106,15 +114,20 @@ def computeEncountersRoad(
         ratesHour.append(fiets_h / 24) #Convert daily rate to per hour rate
         speedsKmh.append(fietsSpeedKmh)
     
-    #Compute encounters for each number of lanes
-    for laneA in range(nLanes):
-        # only upper triangle so that encounters are not double ocunters (j>i)
-        for laneB in range(laneA,nLanes):
-            rateA, rateB = ratesHour[laneA], ratesHour[laneB]
-            speedA, speedB = speedsKmh[laneA], speedsKmh[laneB]
-            enc = computeEncounters(rateA, rateB, speedA, speedB, length_km, 0.84,groupWindow=2)
-            encountersAlong[laneA, laneB] = enc['Encounters (along)']
-            encountersTowards[laneA, laneB] = enc['Encounters (towards)']
+    #Compute encounters only for the lane pairs that interact (upper triangle, j>=i)
+    laneA, laneB, isAlong = template.laneA, template.laneB, template.isAlong
+    if STATS.enabled:
+        STATS.count('pairsEvaluated', laneA.size)
+        STATS.count('pairsSkipped', nLanes * (nLanes + 1) // 2 - laneA.size)
+    ratesHour = np.asarray(ratesHour, dtype=float)
+    speedsKmh = np.asarray(speedsKmh, dtype=float)
+    computePairs = computeEncountersArray if cache is None else cache.computeEncountersArray
+    with STATS.timer('pairEvaluation'):
+        enc = computePairs(ratesHour[laneA], ratesHour[laneB],
+                           speedsKmh[laneA], speedsKmh[laneB],
+                           length_km, 0.84, groupWindow=2, computeAlong=isAlong)
+    encountersAlong[laneA, laneB] = enc['Encounters (along)']
+    encountersTowards[laneA, laneB] = enc['Encounters (towards)']
 
     #Multiply encounter matrix by interaction matrix
     encountersAlong = np.multiply(encountersAlong,interactionAlong)
@@ -124,44 +137,16 @@ def computeEncountersRoad(
     totalEncountersHour = np.sum(encountersAlong) + np.sum(encountersTowards)
     
     
-    #Set lane types for differntiating between encounter types
-    laneTypes = []
-    if fiets_t_allowed:
-        laneTypes.append('bike')  # fiets_t
-    if auto_t_allowed:
-        laneTypes.extend(['car'] * aantal_rijstroken_terug)  # car_t
-    if auto_h_allowed:
-        laneTypes.extend(['car'] * aantal_rijstroken_heen)  # car_h
-    if fiets_h_allowed:
-        laneTypes.append('bike')  # fiets_h
-        
-    # Initialize encounter type counters
-    ccEncounters = 0  # car-car
-    bcEncounters = 0  # bike-car or car-bike
-    bbEncounters = 0  # bike-bike
-    
-    # Compute encounters per lane pair and classify by type
-    nLanes = len(laneTypes)
-    for laneA in range(nLanes):
-        for laneB in range(laneA, nLanes):  # upper triangle to avoid double counting
-            # Total encounters for this lane pair
-            totalPairEnc = encountersAlong[laneA, laneB] + encountersTowards[laneA, laneB]
-            
-            typeA = laneTypes[laneA]
-            typeB = laneTypes[laneB]
-            
-            if typeA == 'car' and typeB == 'car':
-                ccEncounters += totalPairEnc
-            elif typeA == 'bike' and typeB == 'bike':
-                bbEncounters += totalPairEnc
-            else:  # one car, one bike
-                bcEncounters += totalPairEnc
-    
+    #Encounter type breakdown: one masked sum per category of the layout
     results = {
-        'totalEncountersHour': totalEncountersHour,
-        'ccEncountersHour': ccEncounters,
-        'bcEncountersHour': bcEncounters,
-        'bbEncountersHour': bbEncounters}
+        'totalEncountersHour': totalEncountersHour}
+    with STATS.timer('classification'):
+        for category, mask in zip(ENCOUNTER_CATEGORIES, template.categoryMasks):
+            along = np.sum(encountersAlong[mask])
+            towards = np.sum(encountersTowards[mask])
+            results[f'{category}EncountersHour'] = along + towards
+            results[f'{category}AlongEncountersHour'] = along
+            results[f'{category}TowardsEncountersHour'] = towards
         
     # Return results
     return results
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Compact, array-backed road network for network-scale runs.
+    Segment attributes are stored as one typed array per attribute
+    (struct-of-arrays) and the lanes of all segments as one flattened lane
+    table (source, per-lane rate and speed) with per-segment offsets, so no
+    Python lists, dicts or NxN matrices are built per road. The results are
+    preallocated typed arrays, one value per segment, and are filled in
+    chunks of segments, so the temporary lane pair arrays stay bounded by the
+    chunk size.
+
+Memory:
+    About 80 bytes per segment (attributes, layout index, lane offsets),
+    17 bytes per lane and 12 result values per segment (8 bytes each for
+    float64, 4 for float32), see RoadNetwork.estimateBytes. A million segments
+    with 4 lanes each take about 240 MB. Computing a chunk needs roughly
+    1 kB per lane pair on top of that.
+
+Returns:
+    RoadNetwork.compute returns a dict of result arrays (RESULT_COLUMNS,
+    'alongEncountersHour', 'towardsEncountersHour' and the along/towards split
+    per encounter type), also kept as RoadNetwork.results
+"""
+
+from interactionGenerator import ENCOUNTER_CATEGORIES
+from networkEncountersGenerator import (laneInputs, assemblePairs, evaluatePairs, classifyPairs,
+                                        SEGMENT_COLUMNS, RESULT_COLUMNS, CATEGORY_RESULT_COLUMNS)
+import numpy as np
+
+# Storage type of the segment attributes
+SEGMENT_DTYPES = {name: np.float64 for name in SEGMENT_COLUMNS}
+SEGMENT_DTYPES['aantal_rijstroken_heen'] = np.int16
+SEGMENT_DTYPES['aantal_rijstroken_terug'] = np.int16
+
+# Results of RoadNetwork.compute, one value per segment
+NETWORK_RESULT_COLUMNS = RESULT_COLUMNS + ('alongEncountersHour', 'towardsEncountersHour') + CATEGORY_RESULT_COLUMNS
+
+
+class RoadNetwork:
+    """
+    Road network as typed segment columns and a flattened lane table.
+
+    Parameters
+    ----------
+    aantal_rijstroken_heen, ..., length_km : array_like
+        Segment attributes, as computeEncountersNetwork (SEGMENT_COLUMNS)
+
+    Attributes
+    ----------
+    segments : dict of arrays
+        Segment attributes (SEGMENT_COLUMNS), typed as SEGMENT_DTYPES
+    layouts : (nLayouts, 4) array
+        Distinct lane layouts (see interactionGenerator.layoutKey)
+    layoutIndex : int32 array
+        Layout of every segment, index into layouts
+    laneOffsets : int64 array
+        Lanes of segment i are laneOffsets[i]:laneOffsets[i+1] of the lane table
+    laneSource : int8 array
+        LANE_ source of every lane
+    laneRateHour, laneSpeedKmh : float64 arrays
+        Per-lane rate [vehicles per hour] and speed [km/h]
+    results : dict of arrays or None
+        Results of the last compute
+    """
+
+    def __init__(
+        self,
+        aantal_rijstroken_heen,
+        aantal_rijstroken_terug,
+        intensiteit_heen_pae_per_dag,
+        intensiteit_terug_pae_per_dag,
+        snelheid_heen_km_per_uur,
+        snelheid_terug_km_per_uur,
+        fiets_h,
+        fiets_t,
+        fietsSpeedKmh,
+        length_km,
+    ):
+        columns = np.broadcast_arrays(*(np.asarray(x) for x in (
+            aantal_rijstroken_heen, aantal_rijstroken_terug,
+            intensiteit_heen_pae_per_dag, intensiteit_terug_pae_per_dag,
+            snelheid_heen_km_per_uur, snelheid_terug_km_per_uur,
+            fiets_h, fiets_t, fietsSpeedKmh, length_km)))
+        self.segments = {name: np.atleast_1d(column).ravel().astype(SEGMENT_DTYPES[name])
+                         for name, column in zip(SEGMENT_COLUMNS, columns)}
+        s = self.segments
+        nSegments = len(self)
+
+        keys, sourceRates, sourceSpeeds = laneInputs(s)
+        self.layouts, layoutIndex = np.unique(keys, axis=0, return_inverse=True)
+        self.layoutIndex = layoutIndex.ravel().astype(np.int32)
+
+        #Flattened lane table, lanes per segment in the order of the LANE_ constants
+        laneCounts = keys[:, [3, 1, 0, 2]]
+        self.laneOffsets = np.zeros(nSegments + 1, dtype=np.int64)
+        np.cumsum(laneCounts.sum(axis=1), out=self.laneOffsets[1:])
+        self.laneSource = np.repeat(np.tile(np.arange(4, dtype=np.int8), nSegments), laneCounts.ravel())
+        laneSegment = np.repeat(np.arange(nSegments), laneCounts.sum(axis=1))
+        self.laneRateHour = sourceRates[laneSegment, self.laneSource]
+        self.laneSpeedKmh = sourceSpeeds[laneSegment, self.laneSource]
+        self.results = None
+
+    def __len__(self):
+        return self.segments['length_km'].size
+
+    @property
+    def nLanes(self):
+        return self.laneSource.size
+
+    @property
+    def nbytes(self):
+        """
+        Memory of the segment, lane and result arrays in bytes.
+        """
+        arrays = list(self.segments.values()) + [
+            self.layouts, self.layoutIndex, self.laneOffsets,
+            self.laneSource, self.laneRateHour, self.laneSpeedKmh]
+        if self.results is not None:
+            arrays += list(self.results.values())
+        return sum(array.nbytes for array in arrays)
+
+    @staticmethod
+    def estimateBytes(nSegments, lanesPerSegment=4, resultDtype=np.float64):
+        """
+        Expected nbytes of a computed network, for checking a memory budget
+        before loading it.
+        """
+        segmentBytes = sum(np.dtype(dtype).itemsize for dtype in SEGMENT_DTYPES.values())
+        segmentBytes += np.dtype(np.int32).itemsize + np.dtype(np.int64).itemsize
+        laneBytes = 1 + 8 + 8
+        resultBytes = len(NETWORK_RESULT_COLUMNS) * np.dtype(resultDtype).itemsize
+        return int(nSegments * (segmentBytes + resultBytes + lanesPerSegment * laneBytes))
+
+    def compute(self, confidenceTreshold=0.84, groupWindow=2, alongMethod='quadrature', nSamples=10_000,
+                rng=None, cache=None, table=None, deduplicate=False, chunkSize=50_000,
+                resultDtype=np.float64):
+        """
+        Compute the encounters of all segments.
+
+        Parameters
+        ----------
+        confidenceTreshold, ..., deduplicate :
+            As computeEncountersNetwork
+        chunkSize : int or None
+            Segments per evaluation pass, None for all segments at once
+        resultDtype : numpy dtype
+            Type of the result arrays, e.g. np.float32 to halve their memory
+
+        Returns
+        -------
+        results : dict of arrays
+            NETWORK_RESULT_COLUMNS (and 'totalErrorBoundHour' with a table),
+            one value per segment
+        """
+        nSegments = len(self)
+        names = NETWORK_RESULT_COLUMNS + (('totalErrorBoundHour',) if table is not None else ())
+        self.results = {name: np.zeros(nSegments, dtype=resultDtype) for name in names}
+        if alongMethod == 'montecarlo':
+            # one stream for all chunks, so chunks do not repeat the same draws
+            rng = np.random.default_rng(rng)
+        chunkSize = chunkSize or max(nSegments, 1)
+        for start in range(0, nSegments, chunkSize):
+            self._computeChunk(start, min(start + chunkSize, nSegments), confidenceTreshold, groupWindow,
+                               alongMethod, nSamples, rng, cache, table, deduplicate)
+        return self.results
+
+    def _computeChunk(self, start, stop, confidenceTreshold, groupWindow, alongMethod, nSamples,
+                      rng, cache, table, deduplicate):
+        nChunk = stop - start
+        pairs = assemblePairs(self.layouts, self.layoutIndex[start:stop])
+        if pairs.segment.size == 0:
+            # no interacting lanes in this chunk, its results stay zero
+            return
+
+        #Lane table indices of the pairs
+        offsets = self.laneOffsets[start + pairs.segment]
+        pairLaneA, pairLaneB = offsets + pairs.laneA, offsets + pairs.laneB
+        enc = evaluatePairs(self.laneRateHour[pairLaneA], self.laneRateHour[pairLaneB],
+                            self.laneSpeedKmh[pairLaneA], self.laneSpeedKmh[pairLaneB],
+                            self.segments['length_km'][start + pairs.segment], pairs.isAlong,
+                            confidenceTreshold, groupWindow, alongMethod, nSamples, rng,
+                            cache, table, deduplicate)
+
+        #Per-segment sums, straight into the result arrays
+        results = classifyPairs(pairs, enc, nChunk, errorBound=table is not None)
+        results['alongEncountersHour'] = sum(results[f'{c}AlongEncountersHour'] for c in ENCOUNTER_CATEGORIES)
+        results['towardsEncountersHour'] = sum(results[f'{c}TowardsEncountersHour'] for c in ENCOUNTER_CATEGORIES)
+        for name, value in results.items():
+            self.results[name][start:stop] = value
+
+#----------------
+#Example usage
+#---------------
+
+if __name__ == "__main__":
+    import time
+    from benchmarkEncounters import syntheticNetwork
+
+    nSegments = 1_000_000
+    print(f'Expected memory: {RoadNetwork.estimateBytes(nSegments) / 1e6:.0f} MB')
+
+    startTime = time.time()
+    network = RoadNetwork(**syntheticNetwork(nSegments))
+    results = network.compute()
+    print(f'{nSegments} segments ({network.nLanes} lanes) took {time.time() - startTime:.1f} s, '
+          f'{network.nbytes / 1e6:.0f} MB')
+    print('Total encounters per hour:', results['totalEncountersHour'].sum())
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Streaming pipeline from a segment table to an encounter results CSV.
+    The input (a CSV file or a columnar directory, see segmentTable) is read in
+    chunks, every chunk is evaluated with computeEncountersNetwork and appended
+    to the output file, so memory use only depends on the chunk size.
+
+    After every chunk a small JSON checkpoint records the number of finished
+    chunks and the size of the output file. When the pipeline is restarted
+    after an interruption it truncates the output to the last finished chunk
+    and continues from there. The checkpoint also records the model version
+    and settings (encountersGenerator.modelSettings) and the run settings, a
+    run with other settings does not resume it.
+
+Usage:
+    python segmentPipeline.py segments.csv results.csv --chunk-size 50000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from encountersGenerator import modelSettings
+from networkEncountersGenerator import computeEncountersNetwork, SEGMENT_COLUMNS, RESULT_COLUMNS
+from segmentTable import iterSegments, segmentColumnNames, writeResultsRows
+
+
+def _runSettings(settings):
+    """
+    Model version and settings of a run, as stored in the checkpoint.
+    """
+    # defaults of computeEncountersNetwork, so explicit and default settings compare equal
+    settings = {'confidenceTreshold': 0.84, 'groupWindow': 2, **settings}
+    # objects such as an rng or cache are recorded by their repr
+    return json.loads(json.dumps({**modelSettings(), **settings}, sort_keys=True, default=repr))
+
+
+def _readCheckpoint(checkpointPath, inputPath, chunkSize, settings):
+    """
+    Finished chunks and output size of a previous run of the same input, or None.
+    """
+    if not os.path.exists(checkpointPath):
+        return None
+    with open(checkpointPath) as f:
+        checkpoint = json.load(f)
+    if checkpoint['input'] != os.path.abspath(inputPath) or checkpoint['chunkSize'] != chunkSize:
+        raise ValueError(f'Checkpoint {checkpointPath} belongs to another input or chunk size, '
+                         'remove it to start over')
+    if checkpoint.get('settings') != _runSettings(settings):
+        raise ValueError(f'Checkpoint {checkpointPath} was written with other model settings '
+                         f"({checkpoint.get('settings')}), remove it to start over")
+    return checkpoint
+
+
+def _writeCheckpoint(checkpointPath, checkpoint):
+    with open(checkpointPath + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpointPath + '.tmp', checkpointPath)
+
+
+def runPipeline(inputPath, outputPath, chunkSize=50_000, checkpointPath=None, resume=True,
+                progress=None, **settings):
+    """
+    Compute encounters for a segment table chunk by chunk.
+
+    Parameters
+    ----------
+    inputPath : str
+        Segment table, CSV file or columnar directory
+    outputPath : str
+        Output CSV with the segments and their encounters per hour
+    chunkSize : int
+        Number of segments per chunk
+    checkpointPath : str or None
+        Checkpoint file (default: outputPath + '.checkpoint')
+    resume : bool
+        Continue from the checkpoint of an interrupted run, if there is one
+    progress : callable or None
+        Called as progress(doneChunks, doneSegments) after every chunk
+    **settings
+        Passed on to computeEncountersNetwork
+
+    Returns
+    -------
+    doneSegments : int
+        Number of segments computed in this run
+    """
+    checkpointPath = checkpointPath or outputPath + '.checkpoint'
+    checkpoint = _readCheckpoint(checkpointPath, inputPath, chunkSize, settings) if resume else None
+    if checkpoint is None:
+        checkpoint = {'input': os.path.abspath(inputPath), 'chunkSize': chunkSize,
+                      'settings': _runSettings(settings), 'chunksDone': 0, 'outputBytes': 0}
+        open(outputPath, 'w').close()
+
+    doneSegments = 0
+    with open(outputPath, 'r+', newline='') as f:
+        #Drop rows written after the last checkpoint
+        f.truncate(checkpoint['outputBytes'])
+        f.seek(checkpoint['outputBytes'])
+        for segments in iterSegments(inputPath, chunkSize, skipChunks=checkpoint['chunksDone']):
+            results = computeEncountersNetwork(*(segments[c] for c in SEGMENT_COLUMNS), **settings)
+            writeResultsRows(f, segments, results, header=checkpoint['outputBytes'] == 0)
+            f.flush()
+            os.fsync(f.fileno())
+
+            doneSegments += len(segments[SEGMENT_COLUMNS[0]])
+            checkpoint['chunksDone'] += 1
+            checkpoint['outputBytes'] = f.tell()
+            _writeCheckpoint(checkpointPath, checkpoint)
+            if progress is not None:
+                progress(checkpoint['chunksDone'], doneSegments)
+
+        #Empty input: only the header row
+        if checkpoint['outputBytes'] == 0:
+            writeResultsRows(f, {name: [] for name in segmentColumnNames(inputPath)},
+                             {name: [] for name in RESULT_COLUMNS})
+
+    #Finished, nothing to resume (no checkpoint is written for an empty input)
+    if os.path.exists(checkpointPath):
+        os.remove(checkpointPath)
+    return doneSegments
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream a segment table through the road encounter model.')
+    parser.add_argument('segments', help='input CSV file or columnar directory')
+    parser.add_argument('output', help='output CSV with the segments and their encounters per hour')
+    parser.add_argument('--chunk-size', type=int, default=50_000, help='segments per chunk')
+    parser.add_argument('--checkpoint', default=None, help='checkpoint file (default: output + .checkpoint)')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint and start over')
+    parser.add_argument('--confidence', type=float, default=0.84, help='confidence treshold of the road pieces')
+    parser.add_argument('--group-window', type=float, default=2, help='group thinning window [s]')
+    parser.add_argument('--quiet', action='store_true', help='do not report progress')
+    args = parser.parse_args(argv)
+
+    startTime = time.time()
+
+    def printProgress(doneChunks, doneSegments):
+        elapsed = max(time.time() - startTime, 1e-9)
+        print(f'chunk {doneChunks}: {doneSegments} segments, {doneSegments/elapsed:.0f} segments/s',
+              file=sys.stderr)
+
+    runPipeline(args.segments, args.output, chunkSize=args.chunk_size,
+                checkpointPath=args.checkpoint, resume=not args.restart,
+                progress=None if args.quiet else printProgress,
+                confidenceTreshold=args.confidence, groupWindow=args.group_window)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Reading and writing road segment tables.
+    A segment table has one row per road segment and (at least) the columns of
+    networkEncountersGenerator.SEGMENT_COLUMNS. Other columns, such as a segment
+    id, are kept as text and written back next to the results.
+
+    Large tables can be read in chunks, either from a CSV file or from a
+    compact columnar directory with one .npy file per column, which is memory
+    mapped so that only the current chunk is loaded.
+"""
+
+import csv
+from itertools import islice
+import os
+from networkEncountersGenerator import SEGMENT_COLUMNS, RESULT_COLUMNS
+import numpy as np
+
+
+def rowsToColumns(header, rows):
+    """
+    Convert CSV rows to a dict of column arrays (float for the segment columns).
+    """
+    missing = [c for c in SEGMENT_COLUMNS if c not in header]
+    if missing:
+        raise ValueError(f'Segment table is missing the columns {missing}')
+    values = list(zip(*rows)) if rows else [()] * len(header)
+    columns = {}
+    for name, column in zip(header, values):
+        if name in SEGMENT_COLUMNS:
+            columns[name] = np.array(column, dtype=float)
+        else:
+            columns[name] = np.array(column, dtype=str)
+    return columns
+
+
+def readSegmentCsv(path, delimiter=','):
+    """
+    Read a whole segment table into a dict of column arrays.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader)
+        rows = list(reader)
+    return rowsToColumns(header, rows)
+
+
+def iterSegmentCsv(path, chunkSize, skipChunks=0, delimiter=','):
+    """
+    Read a segment table in chunks of chunkSize rows, as dicts of column arrays.
+
+    The first skipChunks chunks are skipped (read but not converted).
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader)
+        #Consume the rows of the skipped chunks without converting them
+        for _ in islice(reader, skipChunks * chunkSize):
+            pass
+        while True:
+            rows = list(islice(reader, chunkSize))
+            if not rows:
+                return
+            yield rowsToColumns(header, rows)
+
+
+def writeSegmentColumns(directory, segments):
+    """
+    Write a segment table as a columnar directory, one .npy file per column.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, column in segments.items():
+        np.save(os.path.join(directory, name + '.npy'), np.asarray(column))
+    #Keep the column order of the table
+    with open(os.path.join(directory, 'columns.txt'), 'w') as f:
+        f.write('\n'.join(segments))
+
+
+def readSegmentColumns(directory):
+    """
+    Open a columnar segment table as memory mapped arrays.
+    """
+    orderPath = os.path.join(directory, 'columns.txt')
+    if os.path.exists(orderPath):
+        with open(orderPath) as f:
+            names = f.read().split()
+    else:
+        names = sorted(f[:-4] for f in os.listdir(directory) if f.endswith('.npy'))
+    segments = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in names}
+    missing = [c for c in SEGMENT_COLUMNS if c not in segments]
+    if missing:
+        raise ValueError(f'Segment table is missing the columns {missing}')
+    return segments
+
+
+def iterSegmentColumns(directory, chunkSize, skipChunks=0):
+    """
+    Read a columnar segment table in chunks of chunkSize rows, as dicts of column arrays.
+    """
+    segments = readSegmentColumns(directory)
+    nSegments = len(segments[SEGMENT_COLUMNS[0]])
+    for start in range(skipChunks * chunkSize, nSegments, chunkSize):
+        yield {name: np.array(column[start:start+chunkSize]) for name, column in segments.items()}
+
+
+def segmentColumnNames(path, delimiter=','):
+    """
+    Column names of a segment table (CSV file or columnar directory), in table order.
+    """
+    if os.path.isdir(path):
+        return list(readSegmentColumns(path))
+    with open(path, newline='') as f:
+        return next(csv.reader(f, delimiter=delimiter))
+
+
+def iterSegments(path, chunkSize, skipChunks=0):
+    """
+    Read a segment table in chunks from a CSV file or a columnar directory.
+    """
+    if os.path.isdir(path):
+        return iterSegmentColumns(path, chunkSize, skipChunks)
+    return iterSegmentCsv(path, chunkSize, skipChunks)
+
+
+def writeResultsCsv(path, segments, results, mode='w', header=True, delimiter=','):
+    """
+    Write segments and their encounter results to a CSV file.
+
+    Parameters
+    ----------
+    path : str
+        Output file
+    segments : dict of arrays
+        Segment table, written in front of the results
+    results : dict of arrays
+        Encounter results per segment (RESULT_COLUMNS)
+    mode : str
+        'w' to overwrite, 'a' to append to an existing file
+    header : bool
+        Write the header row
+    """
+    with open(path, mode, newline='') as f:
+        writeResultsRows(f, segments, results, header, delimiter)
+
+
+def writeResultsRows(f, segments, results, header=True, delimiter=','):
+    """
+    Write segments and their encounter results to an open text file.
+    """
+    names = list(segments) + list(RESULT_COLUMNS)
+    columns = [segments[n] for n in segments] + [results[n] for n in RESULT_COLUMNS]
+    writer = csv.writer(f, delimiter=delimiter)
+    if header:
+        writer.writerow(names)
+    writer.writerows(zip(*(np.asarray(c).tolist() for c in columns)))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Parameter sweeps ("what if") on top of the road encounter model.
+    One road, or a corridor of road segments, is evaluated for every
+    combination of the swept parameter values. The full Cartesian grid is
+    evaluated as one computeEncountersNetwork batch in which identical lane
+    pairs are computed only once. Lane pairs that do not depend on a swept
+    parameter are therefore not recomputed, e.g. sweeping the cycling rate
+    does not re-solve the car-car pairs.
+
+Returns:
+    SweepResult, a labelled multidimensional array: the dimension names, the
+    coordinates of every dimension and one array per result (RESULT_COLUMNS).
+"""
+
+from collections import namedtuple
+from networkEncountersGenerator import computeEncountersNetwork, segmentColumns, SEGMENT_COLUMNS, RESULT_COLUMNS
+import numpy as np
+
+SweepResult = namedtuple('SweepResult', [
+    'dims',  # dimension names: 'segment' (corridors only), then the swept parameters
+    'coords',  # dict of dimension name -> coordinate values
+    'values',  # dict of result name -> array with one axis per dimension
+    ])
+
+
+def sweepEncountersRoad(road, ranges, relative=False, **settings):
+    """
+    Evaluate a road or corridor for every combination of parameter values.
+
+    Parameters
+    ----------
+    road : dict
+        Road attributes (SEGMENT_COLUMNS), scalars for one road or arrays for
+        the segments of a corridor
+    ranges : dict
+        Swept parameter (one of SEGMENT_COLUMNS) -> values
+    relative : bool
+        If True, the values are factors on the road attributes (e.g. 1.1 for
+        10% more traffic) instead of absolute values
+    **settings
+        Passed on to computeEncountersNetwork
+
+    Returns
+    -------
+    result : SweepResult
+    """
+    unknown = [name for name in ranges if name not in SEGMENT_COLUMNS]
+    if unknown:
+        raise ValueError(f'Cannot sweep {unknown}, use one of {SEGMENT_COLUMNS}')
+
+    base, isCorridor = segmentColumns(road)
+    nSegments = base[SEGMENT_COLUMNS[0]].size
+
+    dims = (('segment',) if isCorridor else ()) + tuple(ranges)
+    coords = {'segment': np.arange(nSegments)} if isCorridor else {}
+    coords.update({name: np.asarray(values, dtype=float) for name, values in ranges.items()})
+    shape = (nSegments,) + tuple(coords[name].size for name in ranges)
+
+    #Every segment for every combination of the swept values
+    columns = {}
+    for name in SEGMENT_COLUMNS:
+        column = base[name].reshape((nSegments,) + (1,) * len(ranges))
+        if name in ranges:
+            axis = 1 + list(ranges).index(name)
+            sweep = coords[name].reshape([-1 if d == axis else 1 for d in range(len(shape))])
+            column = column * sweep if relative else sweep
+        columns[name] = np.broadcast_to(column, shape).ravel()
+
+    results = computeEncountersNetwork(**columns, deduplicate=True, **settings)
+    outShape = shape if isCorridor else shape[1:]
+    values = {name: results[name].reshape(outShape) for name in RESULT_COLUMNS}
+    return SweepResult(dims, coords, values)
+
+#----------------
+#Example usage
+#---------------
+
+if __name__ == "__main__":
+    from networkEncountersGenerator import EXAMPLE_ROAD
+
+    # What if intensity rises 10-50% and the speed drops from 50 to 30?
+    sweep = sweepEncountersRoad(EXAMPLE_ROAD, {
+        'intensiteit_heen_pae_per_dag': [1.0, 1.1, 1.2, 1.3, 1.4, 1.5],
+        'snelheid_heen_km_per_uur': [0.6, 0.8, 1.0],
+        }, relative=True)
+    print(sweep.dims)
+    print('Total encounters per day:\n', sweep.values['totalEncountersHour'] * 24)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Dylan van Bezooijen
+
+Function purpose:
+    Uncertainty propagation for the road encounter model.
+    The rates and speeds of a road are described by distributions (e.g. a
+    counted intensity with a 10% error), nScenarios scenarios are drawn from
+    them with a seeded numpy Generator and all scenarios are evaluated as
+    computeEncountersNetwork batches. The scenarios are processed in chunks,
+    so memory is bounded by chunkSize and not by nScenarios. Every uncertain
+    column draws from its own random stream, so the results do not depend on
+    the chunk size.
+
+Returns:
+    UncertaintyResult, with the quantiles, mean and standard deviation of
+    every result and optionally the scenario samples.
+"""
+
+from collections import namedtuple
+from networkEncountersGenerator import computeEncountersNetwork, segmentColumns, SEGMENT_COLUMNS
+import numpy as np
+
+# Columns of computeEncountersRoad that can be uncertain
+UNCERTAIN_COLUMNS = (
+    'intensiteit_heen_pae_per_dag',
+    'intensiteit_terug_pae_per_dag',
+    'snelheid_heen_km_per_uur',
+    'snelheid_terug_km_per_uur',
+    'fiets_h',
+    'fiets_t',
+    'fietsSpeedKmh',
+    )
+SPEED_COLUMNS = ('snelheid_heen_km_per_uur', 'snelheid_terug_km_per_uur', 'fietsSpeedKmh')
+
+# Speed draws are clipped to this minimum, the model needs speeds > 0
+MIN_SPEED_KMH = 1.0
+
+UncertaintyResult = namedtuple('UncertaintyResult', [
+    'quantiles',  # the probabilities of the quantiles
+    'values',  # dict of result name -> value at every quantile
+    'mean',  # dict of result name -> mean over the scenarios
+    'std',  # dict of result name -> standard deviation over the scenarios
+    'samples',  # dict of result name -> value per scenario, or None
+    ])
+
+
+#Distributions: callables that draw n values with a numpy Generator
+def normal(mean, std):
+    return lambda rng, n: rng.normal(mean, std, n)
+
+
+def lognormal(mean, cv):
+    """
+    Lognormal distribution with the given mean and coefficient of variation.
+    """
+    sigma = np.sqrt(np.log(1 + cv**2))
+    return lambda rng, n: rng.lognormal(np.log(mean) - sigma**2 / 2, sigma, n)
+
+
+def uniform(low, high):
+    return lambda rng, n: rng.uniform(low, high, n)
+
+
+def triangular(left, mode, right):
+    return lambda rng, n: rng.triangular(left, mode, right, n)
+
+
+def empirical(values):
+    """
+    Resampling of observed values, e.g. the counts of several days.
+    """
+    values = np.asarray(values, dtype=float)
+    return lambda rng, n: rng.choice(values, n)
+
+
+def computeEncountersUncertainty(road, distributions, nScenarios=10_000, quantiles=(0.05, 0.5, 0.95),
+                                 seed=None, chunkSize=10_000, returnSamples=False, **settings):
+    """
+    Quantiles of the encounters of a road with uncertain rates and speeds.
+
+    Parameters
+    ----------
+    road : dict
+        Road attributes (SEGMENT_COLUMNS), scalars
+    distributions : dict
+        UNCERTAIN_COLUMNS name -> distribution, a callable draw(rng, n) such
+        as normal(8000, 800). Intensities are clipped to 0 and speeds to
+        MIN_SPEED_KMH.
+    nScenarios : int
+        Number of scenarios drawn
+    quantiles : sequence of float
+        Probabilities of the reported quantiles
+    seed : None, int or numpy.random.SeedSequence
+        Seed of the scenario draws
+    chunkSize : int
+        Scenarios per computeEncountersNetwork batch
+    returnSamples : bool
+        Also return the result of every scenario
+    **settings
+        Passed on to computeEncountersNetwork
+
+    Returns
+    -------
+    result : UncertaintyResult
+    """
+    unknown = [name for name in distributions if name not in UNCERTAIN_COLUMNS]
+    if unknown:
+        raise ValueError(f'{unknown} cannot be uncertain, use one of {UNCERTAIN_COLUMNS}')
+    base, isArray = segmentColumns(road)
+    if isArray:
+        raise ValueError('Uncertainty is computed for one road, give the road attributes as scalars')
+
+    #One random stream per uncertain column
+    seedSequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    rngs = {name: np.random.default_rng(child)
+            for name, child in zip(distributions, seedSequence.spawn(len(distributions)))}
+
+    samples = {}
+    for start in range(0, nScenarios, chunkSize):
+        n = min(chunkSize, nScenarios - start)
+        columns = {name: np.repeat(base[name], n) for name in SEGMENT_COLUMNS}
+        for name, draw in distributions.items():
+            minimum = MIN_SPEED_KMH if name in SPEED_COLUMNS else 0.0
+            columns[name] = np.maximum(np.asarray(draw(rngs[name], n), dtype=float), minimum)
+        chunkResults = computeEncountersNetwork(**columns, **settings)
+        for name, value in chunkResults.items():
+            samples.setdefault(name, np.empty(nScenarios))[start:start+n] = value
+
+    quantiles = np.asarray(quantiles, dtype=float)
+    return UncertaintyResult(
+        quantiles,
+        {name: np.quantile(value, quantiles) for name, value in samples.items()},
+        {name: value.mean() for name, value in samples.items()},
+        {name: value.std(ddof=1) if nScenarios > 1 else 0.0 for name, value in samples.items()},
+        samples if returnSamples else None,
+        )
+
+#----------------
+#Example usage
+#---------------
+
+if __name__ == "__main__":
+    from networkEncountersGenerator import EXAMPLE_ROAD
+
+    # Counts with a 10% error, measured speeds and an uncertain cycling speed
+    result = computeEncountersUncertainty(EXAMPLE_ROAD, {
+        'intensiteit_heen_pae_per_dag': lognormal(8000, 0.1),
+        'intensiteit_terug_pae_per_dag': lognormal(7500, 0.1),
+        'snelheid_heen_km_per_uur': normal(52, 4),
+        'snelheid_terug_km_per_uur': normal(48, 4),
+        'fiets_h': lognormal(1500, 0.2),
+        'fiets_t': lognormal(1500, 0.2),
+        'fietsSpeedKmh': triangular(14, 18, 24),
+        }, nScenarios=10_000, seed=0)
+    for name, values in result.values.items():
+        print(f'{name:30s}', ' '.join(f'{v*24:10.0f}' for v in values), 'per day')